@@ -1,17 +1,38 @@
+import os
+import sys
 import logging
+import tempfile
+import hashlib
 import html
+import io
 import asyncio
+import functools
+import re
+import signal
+from datetime import datetime, timedelta, timezone
 from telegram import Update, ChatMember, ChatMemberUpdated, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatType
 from telegram.ext import Application, ApplicationBuilder, ContextTypes, CommandHandler, ChatMemberHandler, CallbackQueryHandler
 from config import load_config
-from utils import restricted, owner_only, is_arbitrator, is_owner
+from utils import restricted, owner_only, is_arbitrator, build_vote_keyboard
 from database import (
     add_arbitrator_db, remove_arbitrator_db, get_all_arbitrators_db,
-    create_motion_db, get_active_motions_db, get_motion_db, close_motion_db,
-    record_vote_db, get_motion_votes_db, set_setting_db, get_setting_db,
-    init_db
+    create_motion_db, get_active_motions_page_db, close_motion_tx,
+    search_motions_db,
+    record_vote_db, set_threshold_db, get_active_motion,
+    get_pending_deadlines_db, export_history, close_db_connection, EXPORT_FORMATS,
+    init_db, load_caches, run_db, shutdown_db_worker, count_pending_outbox_db,
+    OutboxMessage, SEARCH_PAGE_SIZE, SNIPPET_START, SNIPPET_END, connection_counts,
+    add_committee_db, seed_default_committee_db, get_committee, get_user_committees,
+    subscribe_page_db, unsubscribe_page_db, get_committee_pages
 )
-from monitor import start_monitor
+import profiling
+from monitor import start_monitor, stop_monitor, DEFAULT_WIKI, DEFAULT_PAGE_TITLES
+from keyboard_updater import keyboard_updater
+from keyed_lock import motion_locks
+from metrics import TimedRequest, timed_handler, start_metrics_server, stop_metrics_server
+from outbound import dispatcher, PRIORITY_ARCHIVE, PRIORITY_RESULT, PRIORITY_NOTICE
+from outbox import outbox_drainer
 
 # Enable logging
 logging.basicConfig(
@@ -20,6 +41,54 @@ logging.basicConfig(
 )
 
 config = load_config()
+profiling.configure(config.get('profiling', {}))
+
+# Longer titles are cut short in /list_motions so a page stays within
+# Telegram's message length limit
+MAX_LISTED_TITLE = 100
+# Voting deadlines given to /motion as deadline:<number><m|h|d>
+DEADLINE_PATTERN = re.compile(r'^deadline:(\d+)([mhd])$')
+DEADLINE_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+# Longest voting period /motion accepts
+MAX_DEADLINE = timedelta(days=365)
+# Format of deadline_at, matching SQLite's CURRENT_TIMESTAMP (UTC)
+DB_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Longest on-demand profile /profile will take
+MAX_PROFILE_SECONDS = 300
+# How often config.json is checked for changes
+CONFIG_WATCH_INTERVAL = 10
+# Task applying a reloaded proxy_url, kept so it is not garbage collected
+_proxy_switch = None
+SEARCH_STATUSES = {'active': 'active', 'closed': 'closed', '進行中': 'active', '已關閉': 'closed'}
+SEARCH_USAGE = (
+    "用法：/search_motions <關鍵字> [status:active|closed] [by:提案人] "
+    "[from:YYYY-MM-DD] [to:YYYY-MM-DD]"
+)
+
+# Name given to the committee seeded from config.json's arbcom_group_id
+DEFAULT_COMMITTEE_NAME = "仲裁委員會"
+NO_COMMITTEE = "⚠️ 請在委員會群組中使用此指令。"
+# Leading /watch_page argument naming the wiki, e.g. enwiki or wikidatawiki
+WIKI_PATTERN = re.compile(r'^[a-z_]+wiki$')
+
+def current_committee(update):
+    """
+    The committee a command applies to: the one whose group it was sent in,
+    or in a private chat the sender's committee if they sit on exactly one.
+    """
+    chat = update.effective_chat
+    committee = get_committee(chat.id)
+    if committee is None and chat.type == ChatType.PRIVATE:
+        committees = get_user_committees(update.effective_user.id)
+        if len(committees) == 1:
+            committee = committees[0]
+    return committee
+
+def seed_default_committee():
+    """Creates the committee for config.json's group on the first run with committees."""
+    if seed_default_committee_db(config['arbcom_group_id'], DEFAULT_COMMITTEE_NAME, config['archive_channel_id'],
+                                 DEFAULT_WIKI, DEFAULT_PAGE_TITLES):
+        print(f"Created the default committee for chat {config['arbcom_group_id']}.")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -31,55 +100,100 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = (
         "<b>可用指令：</b>\n\n"
         "<b>仲裁員指令：</b>\n"
-        "/motion [標題] | [內容] - 建立新動議\n"
+        "/motion [標題] | [內容] - 建立新動議（可加 deadline:3d 設定投票期限）\n"
         "/list_motions - 列出進行中的動議\n"
+        "/search_motions [關鍵字] - 搜尋動議記錄\n"
         "/close_motion [ID] - 關閉動議\n"
         "/list_arbitrators - 列出授權仲裁員\n"
-        "/set_threshold [活躍人數] [門檻] - 設定絕對多數門檻\n\n"
+        "/set_threshold [活躍人數] [門檻] - 設定絕對多數門檻\n"
+        "/watch_page [wiki] [頁面] - 監察頁面編輯（不帶參數則列出）\n"
+        "/unwatch_page [wiki] [頁面] - 停止監察頁面\n\n"
         "<b>管理員指令：</b>\n"
-        "/add_arbitrator [ID] - 新增仲裁員\n"
-        "/remove_arbitrator [ID] - 移除仲裁員"
+        "/add_committee [存檔頻道ID] [名稱] - 將本群組登記為委員會\n"
+        "/add_arbitrator [ID] [群組ID] - 新增仲裁員\n"
+        "/remove_arbitrator [ID] [群組ID] - 移除仲裁員\n"
+        "/export [jsonl|csv] - 匯出動議及投票記錄\n"
+        "/stats - 查看運行統計\n"
+        "/profile [秒數] - 進行效能取樣"
     )
     await update.message.reply_text(help_text, parse_mode='HTML')
 
+@owner_only
+async def add_committee(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    if chat.type == ChatType.PRIVATE or not context.args:
+        await update.message.reply_text("用法：在委員會群組中使用 /add_committee <存檔頻道ID> [名稱]")
+        return
+    
+    try:
+        archive_channel_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ 無效的頻道ID。請輸入數字。")
+        return
+    
+    name = ' '.join(context.args[1:]) or chat.title or str(chat.id)
+    if await run_db(add_committee_db, chat.id, name, archive_channel_id):
+        await update.message.reply_text(f"✅ 本群組已登記為委員會「{name}」。請以 /add_arbitrator 新增仲裁員。")
+    else:
+        await update.message.reply_text(f"✅ 委員會「{name}」的設定已更新。")
+
+def arbitrator_command_target(update, args):
+    """
+    Parses `<user id> [group id]` for the owner's roster commands. Returns
+    (user_id, committee); the committee is the current one unless a group
+    id is given. Raises ValueError on a non-numeric id.
+    """
+    user_id = int(args[0])
+    committee = get_committee(int(args[1])) if len(args) > 1 else current_committee(update)
+    return user_id, committee
+
 @owner_only
 async def add_arbitrator(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.args:
-        await update.message.reply_text("用法：/add_arbitrator <用戶ID>")
+    if not context.args or len(context.args) > 2:
+        await update.message.reply_text("用法：/add_arbitrator <用戶ID> [群組ID]")
         return
     
     try:
-        user_id = int(context.args[0])
-        if add_arbitrator_db(user_id):
-            await update.message.reply_text(f"✅ 用戶 {user_id} 已新增至仲裁員名單。")
+        user_id, committee = arbitrator_command_target(update, context.args)
+        if committee is None:
+            await update.message.reply_text("⚠️ 找不到委員會。請在委員會群組中使用，或指定群組ID。")
+        elif await run_db(add_arbitrator_db, committee.chat_id, user_id):
+            await update.message.reply_text(f"✅ 用戶 {user_id} 已新增至{committee.name}仲裁員名單。")
         else:
-            await update.message.reply_text(f"⚠️ 用戶 {user_id} 已經是仲裁員了。")
+            await update.message.reply_text(f"⚠️ 用戶 {user_id} 已經是{committee.name}仲裁員了。")
     except ValueError:
         await update.message.reply_text("❌ 無效的用戶ID。請輸入數字。")
 
 @owner_only
 async def remove_arbitrator(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.args:
-        await update.message.reply_text("用法：/remove_arbitrator <用戶ID>")
+    if not context.args or len(context.args) > 2:
+        await update.message.reply_text("用法：/remove_arbitrator <用戶ID> [群組ID]")
         return
     
     try:
-        user_id = int(context.args[0])
-        if remove_arbitrator_db(user_id):
-            await update.message.reply_text(f"✅ 用戶 {user_id} 已從仲裁員名單移除。")
+        user_id, committee = arbitrator_command_target(update, context.args)
+        if committee is None:
+            await update.message.reply_text("⚠️ 找不到委員會。請在委員會群組中使用，或指定群組ID。")
+        elif await run_db(remove_arbitrator_db, committee.chat_id, user_id):
+            await update.message.reply_text(f"✅ 用戶 {user_id} 已從{committee.name}仲裁員名單移除。")
         else:
-            await update.message.reply_text(f"⚠️ 用戶 {user_id} 不是仲裁員。")
+            await update.message.reply_text(f"⚠️ 用戶 {user_id} 不是{committee.name}仲裁員。")
     except ValueError:
         await update.message.reply_text("❌ 無效的用戶ID。請輸入數字。")
 
 @restricted
 async def list_arbitrators(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    arbitrators = get_all_arbitrators_db()
+    committee = current_committee(update)
+    if committee is None:
+        await update.message.reply_text(NO_COMMITTEE)
+        return
+    
+    arbitrators = await run_db(get_all_arbitrators_db, committee.chat_id)
     if not arbitrators:
         await update.message.reply_text("找不到仲裁員。")
         return
     
-    msg = "<b>授權仲裁員：</b>\n"
+    msg = f"<b>{html.escape(committee.name)}授權仲裁員：</b>\n"
     for uid in arbitrators:
         msg += f"- <code>{uid}</code>\n"
     
@@ -91,6 +205,11 @@ async def set_threshold(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("用法：/set_threshold <活躍人數> <絕對多數票數>")
         return
     
+    committee = current_committee(update)
+    if committee is None:
+        await update.message.reply_text(NO_COMMITTEE)
+        return
+    
     try:
         active_count = int(context.args[0])
         majority_threshold = int(context.args[1])
@@ -103,28 +222,26 @@ async def set_threshold(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ 絕對多數票數不能大於活躍人數。")
             return
             
-        set_setting_db('active_arbitrator_count', active_count)
-        set_setting_db('majority_threshold', majority_threshold)
-        
         msg = (
-            f"📢 <b>仲裁委員會設置更新</b>\n\n"
+            f"📢 <b>{html.escape(committee.name)}設置更新</b>\n\n"
             f"<b>活躍仲裁員人數：</b> {active_count}\n"
             f"<b>絕對多數門檻：</b> {majority_threshold}\n\n"
             f"此設置將用於自動判定動議結果。"
         )
         
-        message = await context.bot.send_message(config['arbcom_group_id'], msg, parse_mode='HTML')
+        # The archive channel notice is queued with the change itself
+        archive_notice = OutboxMessage(
+            f"threshold:{update.update_id}", committee.archive_channel_id, msg, 'HTML', PRIORITY_NOTICE
+        )
+        await run_db(set_threshold_db, committee.chat_id, active_count, majority_threshold, [archive_notice])
+        outbox_drainer.wake()
+        
+        message = await dispatcher.send_message(committee.chat_id, msg, PRIORITY_NOTICE, parse_mode='HTML')
         try:
-            await context.bot.pin_chat_message(config['arbcom_group_id'], message.message_id)
+            await context.bot.pin_chat_message(committee.chat_id, message.message_id)
         except Exception:
             pass # Pinning might fail if bot lacks permission
             
-        # Also notify archive channel
-        try:
-            await context.bot.send_message(config['archive_channel_id'], msg, parse_mode='HTML')
-        except Exception as e:
-            print(f"Failed to notify archive channel about threshold update: {e}")
-            
     except ValueError:
         await update.message.reply_text("❌ 無效的數值。請輸入數字。")
 
@@ -179,30 +296,45 @@ async def greet_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE)
         user = update.chat_member.new_chat_member.user
         chat_id = update.chat_member.chat.id
         
-        # Check if this is the authorized group
-        if chat_id != config['arbcom_group_id']:
+        # Only committee groups are guarded, each by its own roster
+        if get_committee(chat_id) is None:
             return
 
-        if is_owner(user.id) or is_arbitrator(user.id):
+        if is_arbitrator(user.id, chat_id):
             # Authorized
             pass
         else:
             # Unauthorized
             await context.bot.ban_chat_member(chat_id, user.id)
             await context.bot.unban_chat_member(chat_id, user.id) # Unban to allow re-join if authorized later
-            await context.bot.send_message(
+            await dispatcher.send_message(
                 chat_id,
                 f"🚫 未授權用戶 {user.mention_html()} 已被移除。",
+                PRIORITY_NOTICE,
                 parse_mode='HTML'
             )
 
 @restricted
 async def motion_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.args:
-        await update.message.reply_text("用法：/motion <標題> | <內容>")
+    usage = "用法：/motion [deadline:<數字><m|h|d>] <標題> | <內容>（期限最長 365 天）"
+    deadline = None
+    args = list(context.args or [])
+    # Only a leading deadline: is the option; later ones are part of the title
+    match = DEADLINE_PATTERN.match(args[0]) if args else None
+    if match:
+        args.pop(0)
+        try:
+            deadline = timedelta(**{DEADLINE_UNITS[match.group(2)]: int(match.group(1))})
+        except (OverflowError, ValueError):
+            deadline = None
+        if deadline is None or not timedelta(0) < deadline <= MAX_DEADLINE:
+            await update.message.reply_text(usage)
+            return
+    if not args:
+        await update.message.reply_text(usage)
         return
     
-    text = ' '.join(context.args)
+    text = ' '.join(args)
     if '|' in text:
         title, content = text.split('|', 1)
         title = title.strip()
@@ -214,20 +346,18 @@ async def motion_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat_id = update.effective_chat.id
     
-    if chat_id != config['arbcom_group_id']:
-        await update.message.reply_text("⚠️ 動議只能在授權群組中建立。")
+    if get_committee(chat_id) is None:
+        await update.message.reply_text("⚠️ 動議只能在委員會群組中建立。")
         return
 
-    motion_id = create_motion_db(title, content, user.id, user.username, chat_id)
+    deadline_at = None
+    if deadline is not None:
+        deadline_at = (datetime.now(timezone.utc) + deadline).strftime(DB_TIME_FORMAT)
+    motion_id = await run_db(create_motion_db, title, content, user.id, user.username, chat_id, deadline_at)
+    if deadline_at is not None:
+        schedule_deadline(context.job_queue, motion_id, deadline_at)
     
-    keyboard = [
-        [
-            InlineKeyboardButton("支持 (0)", callback_data=f"vote:{motion_id}:support"),
-            InlineKeyboardButton("反對 (0)", callback_data=f"vote:{motion_id}:oppose"),
-            InlineKeyboardButton("棄權 (0)", callback_data=f"vote:{motion_id}:abstain"),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = build_vote_keyboard(motion_id, {})
     
     msg_text = (
         f"🗳 <b>動議 #{motion_id}: {html.escape(title)}</b>\n\n"
@@ -235,20 +365,25 @@ async def motion_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"提案人：{user.mention_html()}\n"
         f"狀態：進行中"
     )
+    if deadline_at is not None:
+        msg_text += f"\n投票期限：{deadline_at} (UTC)"
     
-    await update.message.reply_text(msg_text, reply_markup=reply_markup, parse_mode='HTML')
+    message = await update.message.reply_text(msg_text, reply_markup=reply_markup, parse_mode='HTML')
+    keyboard_updater.remember(message.chat_id, message.message_id, {})
 
 async def vote_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user = query.from_user
+    chat_id = query.message.chat.id
     
-    # Verify user is arbitrator
-    if not is_arbitrator(user.id):
+    # Verify user is an arbitrator of this group's committee
+    if not is_arbitrator(user.id, chat_id):
         await query.answer("⛔ 您無權投票。", show_alert=True)
         return
         
     # Verify group
-    if query.message.chat.id != config['arbcom_group_id']:
+    committee = get_committee(chat_id)
+    if committee is None:
         await query.answer("⛔ 只能在授權群組中投票。", show_alert=True)
         return
 
@@ -260,12 +395,25 @@ async def vote_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     motion_id = int(data[1])
     vote_type = data[2]
     
-    motion = get_motion_db(motion_id)
-    if not motion or motion['status'] != 'active':
+    async with motion_locks.hold(motion_id):
+        motion = get_active_motion(motion_id)
+        if motion is None or motion['chat_id'] != chat_id:
+            tallies = None
+        else:
+            tallies = await run_db(record_vote_db, motion_id, user.id, user.username, vote_type)
+            # Queued in vote order; edits from a burst of votes are merged into one
+            keyboard_updater.schedule(context.bot, chat_id, query.message.message_id, motion_id, tallies)
+        # Decided and closed before the next vote on this motion is taken, so
+        # the close always matches the tallies that triggered it
+        decision = auto_close_decision(tallies, committee) if tallies is not None else None
+        if decision:
+            result = await run_db(close_motion_tx, motion_id, functools.partial(archive_messages, *decision))
+        else:
+            result = None
+
+    if tallies is None:
         await query.answer("⚠️ 此動議已關閉。", show_alert=True)
         return
-
-    record_vote_db(motion_id, user.id, user.username, vote_type)
     
     # Log the vote
     logging.info(f"Vote cast: User {user.username} ({user.id}) voted {vote_type} on motion #{motion_id}")
@@ -273,77 +421,192 @@ async def vote_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     vote_map = {"support": "支持", "oppose": "反對", "abstain": "棄權"}
     await query.answer(f"投票已記錄：{vote_map.get(vote_type, vote_type)}")
     
-    # Update message
-    votes = get_motion_votes_db(motion_id)
-    support = sum(1 for v in votes if v['vote_type'] == 'support')
-    oppose = sum(1 for v in votes if v['vote_type'] == 'oppose')
-    abstain = sum(1 for v in votes if v['vote_type'] == 'abstain')
-    
-    keyboard = [
-        [
-            InlineKeyboardButton(f"支持 ({support})", callback_data=f"vote:{motion_id}:support"),
-            InlineKeyboardButton(f"反對 ({oppose})", callback_data=f"vote:{motion_id}:oppose"),
-            InlineKeyboardButton(f"棄權 ({abstain})", callback_data=f"vote:{motion_id}:abstain"),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # Only edit if changed (Telegram API throws error if same)
-    try:
-        await query.edit_message_reply_markup(reply_markup=reply_markup)
-    except Exception:
-        pass
+    if result is not None and result.won:
+        motion_closed(context, motion_id)
+
+def auto_close_decision(tallies, committee):
+    """
+    Returns (outcome, reason) if the tallies settle the motion under the
+    committee's absolute majority threshold, else None.
+    """
+    support = tallies.get('support', 0)
+    oppose = tallies.get('oppose', 0)
+    abstain = tallies.get('abstain', 0)
 
     # Check for auto-close conditions
-    active_count_str = get_setting_db('active_arbitrator_count')
-    majority_threshold_str = get_setting_db('majority_threshold')
+    if not (committee.active_arbitrator_count and committee.majority_threshold):
+        return None
+    active_count = committee.active_arbitrator_count
+    threshold = committee.majority_threshold
     
-    if active_count_str and majority_threshold_str:
-        active_count = int(active_count_str)
-        threshold = int(majority_threshold_str)
+    # Condition 1: Support reaches threshold -> Pass
+    if support >= threshold:
+        return "通過", f"達到絕對多數門檻 ({threshold}票)"
         
-        should_close = False
-        outcome = None
-        reason = ""
-        
-        # Condition 1: Support reaches threshold -> Pass
-        if support >= threshold:
-            should_close = True
-            outcome = "通過"
-            reason = f"達到絕對多數門檻 ({threshold}票)"
-            
-        # Condition 2: Impossible to reach threshold -> Fail
-        # Remaining votes = Active - (Support + Oppose + Abstain)
-        # Max possible support = Support + Remaining
-        # If Max possible support < Threshold -> Fail
-        # Note: This assumes votes are final for the purpose of auto-close, 
-        # or that we want to close as soon as it's mathematically impossible 
-        # assuming current non-support votes stick.
-        # Given user requirement: "if it is already impossible to reach absolute majority... voting should be terminated"
-        total_votes_cast = support + oppose + abstain
-        remaining_votes = active_count - total_votes_cast
-        max_possible_support = support + remaining_votes
-        
-        if max_possible_support < threshold:
-            should_close = True
-            outcome = "未通過"
-            reason = f"無法達到絕對多數門檻 (最大可能支持票: {max_possible_support}, 門檻: {threshold})"
-            
-        if should_close:
-            await execute_close_motion(context, motion_id, outcome, reason)
+    # Condition 2: Impossible to reach threshold -> Fail
+    # Remaining votes = Active - (Support + Oppose + Abstain)
+    # Max possible support = Support + Remaining
+    # If Max possible support < Threshold -> Fail
+    # Note: This assumes votes are final for the purpose of auto-close, 
+    # or that we want to close as soon as it's mathematically impossible 
+    # assuming current non-support votes stick.
+    # Given user requirement: "if it is already impossible to reach absolute majority... voting should be terminated"
+    total_votes_cast = support + oppose + abstain
+    remaining_votes = active_count - total_votes_cast
+    max_possible_support = support + remaining_votes
+    
+    if max_possible_support < threshold:
+        return "未通過", f"無法達到絕對多數門檻 (最大可能支持票: {max_possible_support}, 門檻: {threshold})"
+    return None
 
 @restricted
 async def list_motions(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    motions = get_active_motions_db()
+    committee = current_committee(update)
+    if committee is None:
+        await update.message.reply_text(NO_COMMITTEE)
+        return
+    motions, has_prev, has_next = await run_db(get_active_motions_page_db, committee.chat_id)
     if not motions:
         await update.message.reply_text("目前沒有進行中的動議。")
         return
         
-    msg = "<b>進行中的動議：</b>\n"
-    for m in motions:
-        msg += f"- #{m['id']}: {html.escape(m['title'])} (提案人：{html.escape(m['creator_username'] or 'Unknown')})\n"
+    msg, reply_markup = render_motions_page(motions, has_prev, has_next)
+    await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode='HTML')
+
+async def list_motions_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    committee = current_committee(update)
+    if committee is None or not is_arbitrator(query.from_user.id, committee.chat_id):
+        await query.answer("⛔ 您無權查看。", show_alert=True)
+        return
         
-    await update.message.reply_text(msg, parse_mode='HTML')
+    data = query.data.split(':')
+    if len(data) != 3 or data[1] not in ('after', 'before'):
+        await query.answer("無效的分頁數據。")
+        return
+        
+    anchor = int(data[2])
+    if data[1] == 'after':
+        page = await run_db(get_active_motions_page_db, committee.chat_id, after_id=anchor)
+    else:
+        page = await run_db(get_active_motions_page_db, committee.chat_id, before_id=anchor)
+    if not page[0]:
+        # The motions around the anchor have closed since; start over
+        page = await run_db(get_active_motions_page_db, committee.chat_id)
+    await query.answer()
+    
+    if not page[0]:
+        await query.edit_message_text("目前沒有進行中的動議。")
+        return
+    msg, reply_markup = render_motions_page(*page)
+    await query.edit_message_text(msg, reply_markup=reply_markup, parse_mode='HTML')
+
+def render_motions_page(motions, has_prev, has_next):
+    lines = ["<b>進行中的動議：</b>"]
+    for m in motions:
+        title = m['title'] if len(m['title']) <= MAX_LISTED_TITLE else m['title'][:MAX_LISTED_TITLE] + "…"
+        lines.append(f"- #{m['id']}: {html.escape(title)} (提案人：{html.escape(m['creator_username'] or 'Unknown')})")
+    
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ 上一頁", callback_data=f"motions:before:{motions[0]['id']}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("下一頁 ➡️", callback_data=f"motions:after:{motions[-1]['id']}"))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return "\n".join(lines), reply_markup
+
+def parse_search_args(args):
+    """
+    Splits /search_motions arguments into search terms and filters. Raises
+    ValueError with a message for the user if they are malformed.
+    """
+    search = {'terms': [], 'status': None, 'creator': None, 'date_from': None, 'date_to': None}
+    for arg in args:
+        key, sep, value = arg.partition(':')
+        if sep and key == 'status':
+            if value not in SEARCH_STATUSES:
+                raise ValueError("狀態須為 active 或 closed。")
+            search['status'] = SEARCH_STATUSES[value]
+        elif sep and key == 'by':
+            value = value.lstrip('@')
+            search['creator'] = int(value) if value.isdigit() else value
+        elif sep and key in ('from', 'to'):
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError("日期格式須為 YYYY-MM-DD。")
+            search['date_from' if key == 'from' else 'date_to'] = value
+        else:
+            search['terms'].append(arg)
+    if not search['terms']:
+        raise ValueError(SEARCH_USAGE)
+    return search
+
+@restricted
+async def search_motions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        search = parse_search_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+
+    committee = current_committee(update)
+    if committee is None:
+        await update.message.reply_text(NO_COMMITTEE)
+        return
+
+    # Kept per user so the page buttons only need to carry an offset
+    context.user_data['motion_search'] = search
+    rows, has_more = await run_db(search_motions_db, chat_id=committee.chat_id, **search)
+    if not rows:
+        await update.message.reply_text("找不到符合的動議。")
+        return
+
+    msg, reply_markup = render_search_page(rows, 0, has_more)
+    await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode='HTML')
+
+async def search_motions_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    committee = current_committee(update)
+    if committee is None or not is_arbitrator(query.from_user.id, committee.chat_id):
+        await query.answer("⛔ 您無權查看。", show_alert=True)
+        return
+
+    search = context.user_data.get('motion_search')
+    data = query.data.split(':')
+    if search is None or len(data) != 2 or not data[1].isdigit():
+        await query.answer("搜尋已過期，請重新搜尋。", show_alert=True)
+        return
+
+    offset = int(data[1])
+    rows, has_more = await run_db(search_motions_db, chat_id=committee.chat_id, offset=offset, **search)
+    await query.answer()
+    if not rows:
+        await query.edit_message_text("找不到符合的動議。")
+        return
+    msg, reply_markup = render_search_page(rows, offset, has_more)
+    await query.edit_message_text(msg, reply_markup=reply_markup, parse_mode='HTML')
+
+def render_search_page(rows, offset, has_more):
+    lines = [f"<b>搜尋結果（第 {offset // SEARCH_PAGE_SIZE + 1} 頁）：</b>"]
+    for m in rows:
+        title = m['title'] if len(m['title']) <= MAX_LISTED_TITLE else m['title'][:MAX_LISTED_TITLE] + "…"
+        status = "進行中" if m['status'] == 'active' else "已關閉"
+        # Escape first, then turn the snippet's hit markers into bold tags
+        snippet = html.escape(m['snippet']).replace(SNIPPET_START, "<b>").replace(SNIPPET_END, "</b>")
+        lines.append(
+            f"\n#{m['id']} [{status}] {html.escape(title)}\n"
+            f"提案人：{html.escape(m['creator_username'] or 'Unknown')}，{m['created_at'][:10]}\n"
+            f"{snippet}"
+        )
+
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("⬅️ 上一頁", callback_data=f"search:{max(0, offset - SEARCH_PAGE_SIZE)}"))
+    if has_more:
+        buttons.append(InlineKeyboardButton("下一頁 ➡️", callback_data=f"search:{offset + SEARCH_PAGE_SIZE}"))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return "\n".join(lines), reply_markup
 
 @restricted
 async def close_motion(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -356,60 +619,109 @@ async def close_motion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("無效的動議ID。")
         return
-        
-    motion = get_motion_db(motion_id)
-    if not motion:
-        await update.message.reply_text("找不到該動議。")
+    
+    committee = current_committee(update)
+    if committee is None:
+        await update.message.reply_text(NO_COMMITTEE)
         return
         
-    if motion['status'] != 'active':
-        await update.message.reply_text("該動議已經關閉。")
+    async with motion_locks.hold(motion_id):
+        motion = get_active_motion(motion_id)
+        if motion is not None and motion['chat_id'] != committee.chat_id:
+            # Another committee's motion
+            result = None
+        else:
+            result = await run_db(close_motion_tx, motion_id, functools.partial(archive_messages, None, "手動關閉"))
+    if result is None or not result.won:
+        if result is not None and result.motion and result.motion['chat_id'] == committee.chat_id:
+            await update.message.reply_text("該動議已經關閉。")
+        else:
+            await update.message.reply_text("找不到該動議。")
         return
         
-    close_motion_db(motion_id)
-    
-    # Calculate results
-    votes = get_motion_votes_db(motion_id)
-    support = sum(1 for v in votes if v['vote_type'] == 'support')
-    oppose = sum(1 for v in votes if v['vote_type'] == 'oppose')
-    abstain = sum(1 for v in votes if v['vote_type'] == 'abstain')
+    motion_closed(context, motion_id)
+    await update.message.reply_text(f"動議 #{motion_id} 已關閉並存檔。")
+
+def simple_majority_outcome(tallies):
+    support = tallies.get('support', 0)
+    oppose = tallies.get('oppose', 0)
     
     if support > oppose:
-        outcome = "通過"
+        return "通過"
     elif oppose > support:
-        outcome = "未通過"
+        return "未通過"
     else:
-        outcome = "平局"
-        
-    await execute_close_motion(context, motion_id, outcome, "手動關閉")
-    await update.message.reply_text(f"動議 #{motion_id} 已關閉並存檔。")
+        return "平局"
+
+def schedule_deadline(job_queue, motion_id, deadline_at):
+    """
+    Schedules a one-off job closing the motion at its deadline. Deadlines
+    that passed while the bot was down fire straight away.
+    """
+    due = datetime.strptime(deadline_at, DB_TIME_FORMAT).replace(tzinfo=timezone.utc)
+    delay = max(0.0, (due - datetime.now(timezone.utc)).total_seconds())
+    job_queue.run_once(deadline_expired, delay, data=motion_id, name=f"deadline:{motion_id}")
+
+def cancel_deadline(job_queue, motion_id):
+    for job in job_queue.get_jobs_by_name(f"deadline:{motion_id}"):
+        job.schedule_removal()
+
+async def deadline_expired(context: ContextTypes.DEFAULT_TYPE):
+    await execute_close_motion(context, context.job.data, None, "投票期限屆滿")
 
 async def execute_close_motion(context, motion_id, outcome, reason):
-    motion = get_motion_db(motion_id)
-    if not motion:
-        return
-        
-    # Ensure it's closed in DB if not already (for manual close it is, for auto it might not be)
-    if motion['status'] == 'active':
-        close_motion_db(motion_id)
-        
-    votes = get_motion_votes_db(motion_id)
-    support = sum(1 for v in votes if v['vote_type'] == 'support')
-    oppose = sum(1 for v in votes if v['vote_type'] == 'oppose')
-    abstain = sum(1 for v in votes if v['vote_type'] == 'abstain')
+    """
+    Closes a motion and archives the result. Returns False, without archiving,
+    if another caller closed it first. An `outcome` of None is decided by
+    simple majority of the final tallies.
+    """
+    async with motion_locks.hold(motion_id):
+        result = await run_db(close_motion_tx, motion_id, functools.partial(archive_messages, outcome, reason))
+    if not result.won:
+        return False
+    motion_closed(context, motion_id)
+    return True
+
+def motion_closed(context, motion_id):
+    """Follow-up once a motion has been closed and its archive posts queued."""
+    # However it was closed, its deadline no longer applies
+    cancel_deadline(context.job_queue, motion_id)
+    outbox_drainer.wake()
+
+def archive_channel_for(motion):
+    """
+    Returns the archive channel for a motion: its committee's, or the default
+    committee's if its chat is not a committee, so the motion can still close.
+    """
+    committee = get_committee(motion['chat_id'])
+    if committee is None:
+        logging.warning(f"Motion #{motion['id']} belongs to chat {motion['chat_id']}, which is not a committee; "
+                        f"archiving it to the default committee's channel")
+        committee = get_committee(config['arbcom_group_id'])
+    if committee is None:
+        return config['archive_channel_id']
+    return committee.archive_channel_id
+
+def archive_messages(outcome, reason, result):
+    """
+    Builds the archive post (and, unless closed by hand, the group notice)
+    for a closed motion. Runs inside close_motion_tx so they are queued in
+    the outbox with the close. An `outcome` of None is decided by simple
+    majority of the final tallies.
+    """
+    motion = result.motion
+    motion_id = motion['id']
+    if outcome is None:
+        outcome = simple_majority_outcome(result.tallies)
     
     # Format voter list
-    support_voters = [v['username'] or str(v['user_id']) for v in votes if v['vote_type'] == 'support']
-    oppose_voters = [v['username'] or str(v['user_id']) for v in votes if v['vote_type'] == 'oppose']
-    abstain_voters = [v['username'] or str(v['user_id']) for v in votes if v['vote_type'] == 'abstain']
-    
     voter_list = ""
-    if support_voters:
-        voter_list += f"✅ <b>支持 ({support}):</b> {', '.join(support_voters)}\n"
-    if oppose_voters:
-        voter_list += f"❌ <b>反對 ({oppose}):</b> {', '.join(oppose_voters)}\n"
-    if abstain_voters:
-        voter_list += f"⚪ <b>棄權 ({abstain}):</b> {', '.join(abstain_voters)}\n"
+    if result.tallies.get('support'):
+        voter_list += f"✅ <b>支持 ({result.tallies['support']}):</b> {result.voters['support']}\n"
+    if result.tallies.get('oppose'):
+        voter_list += f"❌ <b>反對 ({result.tallies['oppose']}):</b> {result.voters['oppose']}\n"
+    if result.tallies.get('abstain'):
+        voter_list += f"⚪ <b>棄權 ({result.tallies['abstain']}):</b> {result.voters['abstain']}\n"
     
     # Archive
     archive_text = (
@@ -423,32 +735,257 @@ async def execute_close_motion(context, motion_id, outcome, reason):
         f"<b>備註：</b> {reason}"
     )
     
+    messages = [OutboxMessage(f"motion:{motion_id}:archive", archive_channel_for(motion), archive_text, 'HTML', PRIORITY_ARCHIVE)]
+    # Also notify group if auto-closed
+    if reason != "手動關閉":
+        messages.append(OutboxMessage(
+            f"motion:{motion_id}:closed",
+            motion['chat_id'],
+            f"ℹ️ 動議 #{motion_id} 已自動關閉：{outcome} ({reason})",
+            'HTML',
+            PRIORITY_RESULT
+        ))
+    return messages
+
+def parse_page_args(args):
+    """Splits `[wiki] <title>` arguments; the wiki defaults to DEFAULT_WIKI."""
+    wiki = DEFAULT_WIKI
+    if len(args) > 1 and WIKI_PATTERN.match(args[0]):
+        wiki, args = args[0], args[1:]
+    # recentchange titles use spaces, page URLs use underscores
+    return wiki, ' '.join(args).replace('_', ' ')
+
+@restricted
+async def watch_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    committee = current_committee(update)
+    if committee is None:
+        await update.message.reply_text(NO_COMMITTEE)
+        return
+    
+    if not context.args:
+        pages = get_committee_pages(committee.chat_id)
+        if not pages:
+            await update.message.reply_text("本委員會沒有監察任何頁面。用法：/watch_page [wiki] <頁面>")
+            return
+        msg = "<b>監察中的頁面：</b>\n" + "".join(f"- {wiki}：{html.escape(title)}\n" for wiki, title in pages)
+        await update.message.reply_text(msg, parse_mode='HTML')
+        return
+    
+    wiki, title = parse_page_args(context.args)
+    if await run_db(subscribe_page_db, committee.chat_id, wiki, title):
+        await update.message.reply_text(f"✅ 已開始監察 {wiki} 的「{title}」。")
+    else:
+        await update.message.reply_text(f"⚠️ 已在監察 {wiki} 的「{title}」。")
+
+@restricted
+async def unwatch_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    committee = current_committee(update)
+    if committee is None:
+        await update.message.reply_text(NO_COMMITTEE)
+        return
+    if not context.args:
+        await update.message.reply_text("用法：/unwatch_page [wiki] <頁面>")
+        return
+    
+    wiki, title = parse_page_args(context.args)
+    if await run_db(unsubscribe_page_db, committee.chat_id, wiki, title):
+        await update.message.reply_text(f"✅ 已停止監察 {wiki} 的「{title}」。")
+    else:
+        await update.message.reply_text(f"⚠️ 沒有監察 {wiki} 的「{title}」。")
+
+@owner_only
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fmt = context.args[0].lower() if context.args else 'jsonl'
+    if fmt not in EXPORT_FORMATS:
+        await update.message.reply_text("用法：/export [jsonl|csv]")
+        return
+
+    await update.message.reply_text("⏳ 正在匯出動議及投票記錄…")
+    # Exported on a separate thread with its own connection, so neither the
+    # event loop nor the DB worker waits for it
+    path, count = await asyncio.to_thread(export_to_temp_file, fmt)
+    try:
+        with open(path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"motions-{datetime.now(timezone.utc):%Y%m%d}.{fmt}.gz",
+                caption=f"共 {count} 項動議",
+            )
+    finally:
+        os.remove(path)
+
+def export_to_temp_file(fmt):
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
     try:
-        await context.bot.send_message(config['archive_channel_id'], archive_text, parse_mode='HTML')
-        # Also notify group if auto-closed
-        if reason != "手動關閉":
-             await context.bot.send_message(config['arbcom_group_id'], f"ℹ️ 動議 #{motion_id} 已自動關閉：{outcome} ({reason})", parse_mode='HTML')
+        return path, export_history(path, fmt)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        close_db_connection()
+
+@owner_only
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uptime, updates, average, per_minute, paths = profiling.summary()
+    opened, closed = connection_counts()
+    lines = [
+        f"<b>📊 運行統計</b>（已運行 {int(uptime // 3600)} 小時 {int(uptime % 3600 // 60)} 分鐘）\n",
+        f"<b>資料庫連線：</b>已開啟 {opened}，已關閉 {closed}，使用中 {opened - closed}",
+        f"<b>待發送訊息：</b>{await run_db(count_pending_outbox_db)}",
+    ]
+    if not profiling.ENABLED:
+        lines.append("\n效能分析未啟用（config.json 的 profiling.enabled）。")
+    else:
+        lines.append(f"<b>更新：</b>共 {updates} 次，平均 {average:.1f} 次/分鐘，最近一分鐘 {per_minute:.0f} 次")
+        lines.append("\n<b>最慢路徑（平均耗時）：</b>")
+        for path, n, wall, cpu, db, api, max_wall in paths:
+            lines.append(
+                f"• {html.escape(path)} — {n} 次，平均 {wall * 1000:.1f} ms，最長 {max_wall * 1000:.0f} ms\n"
+                f"  CPU {cpu * 1000:.1f} / DB {db * 1000:.1f} / API {api * 1000:.1f} ms"
+            )
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+@owner_only
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    seconds = 30
+    if context.args:
+        try:
+            seconds = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("用法：/profile [秒數]")
+            return
+    seconds = max(1, min(seconds, MAX_PROFILE_SECONDS))
+    await update.message.reply_text(f"⏱ 開始效能取樣 {seconds} 秒…")
+    # Runs in the background so updates keep being handled while sampling
+    context.application.create_task(send_profile(context.bot, update.effective_chat.id, seconds))
+
+async def send_profile(bot, chat_id, seconds):
+    report = await profiling.sample_profile(seconds)
+    if report is None:
+        await bot.send_message(chat_id, "⚠️ 已有效能取樣正在進行。")
+        return
+    await bot.send_document(chat_id, document=io.BytesIO(report.encode()), filename=f"profile-{seconds}s.txt")
+
+def apply_config(requests, old, new):
+    """Applies reloaded settings that live outside the config object."""
+    global _proxy_switch
+    if new.get('profiling') != old.get('profiling'):
+        profiling.configure(new.get('profiling', {}))
+    if new.get('proxy_url') != old.get('proxy_url'):
+        _proxy_switch = asyncio.get_running_loop().create_task(switch_proxy(requests, new.get('proxy_url') or None))
+
+async def switch_proxy(requests, proxy):
+    try:
+        for request in requests:
+            await request.set_proxy(proxy)
     except Exception as e:
-        print(f"Failed to archive motion #{motion_id}: {e}")
+        logging.error(f"Failed to switch the proxy to {proxy}: {e}")
+    else:
+        print(f"Using proxy: {proxy}" if proxy else "Proxy disabled")
+
+async def watch_config(context: ContextTypes.DEFAULT_TYPE):
+    config.reload_if_changed()
 
 async def post_init(application: Application):
     """
     Post initialization hook to start background tasks.
     """
-    loop = asyncio.get_running_loop()
-    start_monitor(application, loop)
+    # Settings are reloaded on SIGHUP and whenever config.json changes
+    if hasattr(signal, 'SIGHUP'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, config.reload)
+    application.job_queue.run_repeating(watch_config, CONFIG_WATCH_INTERVAL, name="watch_config")
+    dispatcher.start(application.bot)
+    # Also sends whatever was left in the outbox by the previous run
+    outbox_drainer.start()
+    start_monitor()
+    # Only motions still waiting for a deadline get a job
+    for row in await run_db(get_pending_deadlines_db):
+        schedule_deadline(application.job_queue, row['id'], row['deadline_at'])
+    if config.get('metrics_port'):
+        await start_metrics_server(config.get('metrics_listen', '127.0.0.1'), config['metrics_port'])
 
-if __name__ == '__main__':
-    # Initialize database
-    init_db()
-    
+async def post_stop(application: Application):
+    """
+    Post stop hook to stop background tasks. It runs after the handlers and
+    jobs have finished but before Application.shutdown() closes the bot's
+    HTTP clients, so the dispatcher can still send what is queued.
+    """
+    await stop_monitor()
+    await outbox_drainer.stop()
+    await dispatcher.stop()
+    await stop_metrics_server()
+
+async def post_shutdown(application: Application):
+    """
+    Post shutdown hook to release the database worker.
+    """
+    shutdown_db_worker()
+
+def webhook_options():
+    """
+    Translates the "webhook" config section into Updater.start_webhook
+    arguments. Telegram posts to `url` (the public HTTPS address, usually a
+    reverse proxy) and the bot listens on `listen`:`port`. When `cert` and
+    `key` are set the bot terminates TLS itself instead.
+    """
+    settings = config.get('webhook', {})
+    if not settings.get('url'):
+        print("Error: webhook mode needs webhook.url, the public HTTPS address Telegram posts to.")
+        sys.exit(1)
+    # An unguessable path, so only Telegram knows where to post
+    url_path = settings.get('path') or hashlib.sha256(config['bot_token'].encode()).hexdigest()[:32]
+    return {
+        'listen': settings.get('listen', '127.0.0.1'),
+        'port': int(settings.get('port', 8443)),
+        'url_path': url_path,
+        'webhook_url': f"{settings['url'].rstrip('/')}/{url_path}",
+        'secret_token': settings.get('secret_token') or None,
+        'cert': settings.get('cert') or None,
+        'key': settings.get('key') or None,
+        'max_connections': int(settings.get('max_connections', 40)),
+    }
+
+def run_application(application):
+    """
+    Runs the bot in the delivery mode chosen by config "mode". Both modes
+    serve the same handlers and ask for the same update types, and neither
+    drops pending updates: switching is a config change plus a restart, and
+    whichever mode starts next deletes or sets the webhook and picks up
+    whatever Telegram queued in between.
+    """
+    if config['mode'] == 'webhook':
+        options = webhook_options()
+        print(f"Bot is running (webhook on {options['listen']}:{options['port']})...")
+        application.run_webhook(allowed_updates=Update.ALL_TYPES, drop_pending_updates=False, **options)
+    else:
+        print("Bot is running...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=False)
+
+def build_application(base_url=None):
+    """
+    Builds the Application and registers every handler. `base_url` points the
+    bot at another Bot API server, such as a local stand-in used for testing.
+    """
     builder = ApplicationBuilder().token(config['bot_token'])
     builder.post_init(post_init)
+    builder.post_stop(post_stop)
+    builder.post_shutdown(post_shutdown)
+    # Updates are handled concurrently; those touching the same motion are
+    # serialised by motion_locks instead
+    builder.concurrent_updates(True)
+    if base_url:
+        builder.base_url(base_url)
     
-    # Add proxy support if configured
-    if config.get('proxy_url'):
-        builder.proxy_url(config['proxy_url'])
-        print(f"Using proxy: {config['proxy_url']}")
+    # Bot API calls go through TimedRequest for the latency metrics, with the
+    # proxy (if configured) set on the requests themselves
+    proxy = config.get('proxy_url') or None
+    if proxy:
+        print(f"Using proxy: {proxy}")
+    requests = (TimedRequest(connection_pool_size=256, proxy=proxy), TimedRequest(connection_pool_size=1, proxy=proxy))
+    builder.request(requests[0])
+    builder.get_updates_request(requests[1])
+    config.on_reload(lambda old, new: apply_config(requests, old, new))
         
     application = builder.build()
     
@@ -458,6 +995,12 @@ if __name__ == '__main__':
     application.add_handler(CommandHandler('remove_arbitrator', remove_arbitrator))
     application.add_handler(CommandHandler('list_arbitrators', list_arbitrators))
     application.add_handler(CommandHandler('set_threshold', set_threshold))
+    application.add_handler(CommandHandler('add_committee', add_committee))
+    application.add_handler(CommandHandler('watch_page', watch_page))
+    application.add_handler(CommandHandler('unwatch_page', unwatch_page))
+    application.add_handler(CommandHandler('export', export))
+    application.add_handler(CommandHandler('stats', stats))
+    application.add_handler(CommandHandler('profile', profile_command))
     
     # Handle members joining/leaving chats
     application.add_handler(ChatMemberHandler(greet_chat_members, ChatMemberHandler.CHAT_MEMBER))
@@ -465,8 +1008,25 @@ if __name__ == '__main__':
     # Motion handlers
     application.add_handler(CommandHandler('motion', motion_command))
     application.add_handler(CommandHandler('list_motions', list_motions))
+    application.add_handler(CommandHandler('search_motions', search_motions))
     application.add_handler(CommandHandler('close_motion', close_motion))
-    application.add_handler(CallbackQueryHandler(vote_callback))
+    application.add_handler(CallbackQueryHandler(vote_callback, pattern=r'^vote:'))
+    application.add_handler(CallbackQueryHandler(list_motions_callback, pattern=r'^motions:'))
+    application.add_handler(CallbackQueryHandler(search_motions_callback, pattern=r'^search:'))
+    
+    # Record latency and errors of every handler, and profile them if enabled
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = profiling.profiled(handler.callback.__name__, handler.callback)
+            handler.callback = timed_handler(callback.__name__, callback)
+    
+    return application
+
+if __name__ == '__main__':
+    # Initialize database and warm the in-memory caches
+    init_db()
+    seed_default_committee()
+    load_caches()
     
-    print("Bot is running...")
-    application.run_polling()
+    application = build_application()
+    run_application(application)
@@ -3,23 +3,145 @@ import os
 import sys
 
 CONFIG_FILE = "config.json"
+# Any setting can be overridden by an environment variable, e.g.
+# ARBCOM_BOT_PROXY_URL or ARBCOM_BOT_WEBHOOK='{"url": "..."}'
+ENV_PREFIX = "ARBCOM_BOT_"
 
-def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        print(f"Error: {CONFIG_FILE} not found. Please create it from the template.")
-        sys.exit(1)
-        
-    with open(CONFIG_FILE, 'r') as f:
+# key -> (type, default); keys without a default are required
+SCHEMA = {
+    'bot_token': (str, None),
+    'owner_id': (int, None),
+    'arbcom_group_id': (int, None),
+    'archive_channel_id': (int, None),
+    'proxy_url': (str, ''),
+    'stream_url': (str, ''),
+    'monitor_digest_window': (float, 60),
+    'metrics_port': (int, 0),
+    'metrics_listen': (str, '127.0.0.1'),
+    'mode': (str, 'polling'),
+    'webhook': (dict, {}),
+    'profiling': (dict, {}),
+}
+# Only read at startup; a reload keeps them but warns that a restart is needed
+RESTART_KEYS = ('bot_token', 'mode', 'webhook', 'metrics_port', 'metrics_listen')
+# Only used to create the default committee on the first start; later
+# changes are made with /add_committee and are not read from here
+SEED_KEYS = ('arbcom_group_id', 'archive_channel_id')
+
+class ConfigError(Exception):
+    pass
+
+def _check_type(key, value, expected):
+    if expected is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        raise ConfigError(f"{key} must be of type {expected.__name__}, got {type(value).__name__}")
+    return value
+
+def _from_env(key, raw, expected):
+    try:
+        if expected is dict:
+            return json.loads(raw)
+        return expected(raw)
+    except ValueError:
+        raise ConfigError(f"{ENV_PREFIX}{key.upper()} is not a valid {expected.__name__}")
+
+class Config:
+    """
+    The bot's settings: config.json overlaid with environment variables and
+    checked against SCHEMA. Readers look values up at use time, so after a
+    reload every module sees the new settings; a reload that fails
+    validation keeps the current ones.
+    """
+
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self._values = {}
+        self._mtime = None
+        self._listeners = []
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def get(self, key, default=None):
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            raise ConfigError(f"{self.path} not found. Please create it from the template.")
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, 'r') as f:
+            try:
+                values = json.load(f)
+            except json.JSONDecodeError:
+                raise ConfigError(f"Failed to decode {self.path}. Please ensure it is valid JSON.")
+
+        for key, (expected, default) in SCHEMA.items():
+            raw = os.environ.get(ENV_PREFIX + key.upper())
+            if raw is not None:
+                values[key] = _from_env(key, raw, expected)
+            elif key not in values and default is not None:
+                values[key] = default
+
+        missing = [key for key, (_, default) in SCHEMA.items() if default is None and key not in values]
+        if missing:
+            raise ConfigError(f"Missing configuration keys: {', '.join(missing)}")
+        for key, (expected, _) in SCHEMA.items():
+            values[key] = _check_type(key, values[key], expected)
+        if values['mode'] not in ('polling', 'webhook'):
+            raise ConfigError(f"unknown mode {values['mode']!r}; use \"polling\" or \"webhook\"")
+        return values, mtime
+
+    def load(self):
         try:
-            config = json.load(f)
-            required_keys = ["bot_token", "owner_id", "arbcom_group_id", "archive_channel_id"]
-            missing = [key for key in required_keys if key not in config]
-            
-            if missing:
-                print(f"Error: Missing configuration keys: {', '.join(missing)}")
-                sys.exit(1)
-                
-            return config
-        except json.JSONDecodeError:
-            print(f"Error: Failed to decode {CONFIG_FILE}. Please ensure it is valid JSON.")
+            self._values, self._mtime = self._read()
+        except ConfigError as e:
+            print(f"Error: {e}")
             sys.exit(1)
+
+    def reload(self):
+        """Re-reads the settings and swaps them in as a whole. Returns True on success."""
+        try:
+            values, self._mtime = self._read()
+        except ConfigError as e:
+            print(f"Config reload failed, keeping the current settings: {e}")
+            return False
+        old, self._values = self._values, values
+        changed = sorted(key for key in values.keys() | old.keys() if values.get(key) != old.get(key))
+        print(f"Configuration reloaded; changed: {', '.join(changed) or 'nothing'}")
+        for key in changed:
+            if key in RESTART_KEYS:
+                print(f"Warning: a change to {key} takes effect after a restart.")
+            elif key in SEED_KEYS:
+                print(f"Warning: {key} only sets up the default committee on the first start; "
+                      f"use /add_committee in the committee's group to change it.")
+        for listener in self._listeners:
+            listener(old, values)
+        return True
+
+    def reload_if_changed(self):
+        """Reloads if the file was modified since it was last read."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        # Remembered even if the reload fails, so a bad file is reported once
+        self._mtime = mtime
+        return self.reload()
+
+    def on_reload(self, listener):
+        """Registers listener(old, new) to run after every successful reload."""
+        self._listeners.append(listener)
+
+_config = None
+
+def load_config():
+    """Returns the shared Config, reading config.json the first time."""
+    global _config
+    if _config is None:
+        _config = Config()
+        _config.load()
+    return _config
@@ -1,150 +1,920 @@
 import sqlite3
+import re
 import contextlib
+import argparse
+import csv
+import gzip
+import json
+import threading
+import asyncio
+import functools
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from motion_store import MotionStore
+from metrics import db_query_latency
+from profiling import add_db_time
 
 DB_NAME = "bot_database.db"
 
+# Applied once to every new connection. WAL lets readers run alongside the
+# writer and, with synchronous=NORMAL, only fsyncs at checkpoints instead of
+# on every commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",       # 8 MiB page cache
+    "PRAGMA mmap_size=67108864",     # 64 MiB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Active motions shown per /list_motions page
+MOTIONS_PAGE_SIZE = 10
+
+# Results shown per /search_motions page
+SEARCH_PAGE_SIZE = 5
+
+# Size of sqlite3's per-connection prepared statement cache. Every query below
+# is a module-level constant, so repeated calls reuse the compiled statement.
+STATEMENT_CACHE_SIZE = 64
+
+# sqlite3 connections must not be shared between threads, so each thread keeps
+# its own long-lived connection instead of reconnecting on every call.
+_local = threading.local()
+
+SQL_ADD_ARBITRATOR = "INSERT INTO committee_members (chat_id, user_id) VALUES (?, ?)"
+SQL_REMOVE_ARBITRATOR = "DELETE FROM committee_members WHERE chat_id = ? AND user_id = ?"
+SQL_GET_ALL_ARBITRATORS = "SELECT user_id FROM committee_members WHERE chat_id = ? ORDER BY added_at"
+SQL_GET_ALL_MEMBERS = "SELECT chat_id, user_id FROM committee_members"
+SQL_GET_COMMITTEES = "SELECT * FROM committees"
+SQL_GET_COMMITTEE = "SELECT * FROM committees WHERE chat_id = ?"
+SQL_UPSERT_COMMITTEE = '''
+    INSERT INTO committees (chat_id, name, archive_channel_id) VALUES (?, ?, ?)
+    ON CONFLICT (chat_id) DO UPDATE SET name = excluded.name, archive_channel_id = excluded.archive_channel_id
+'''
+SQL_SET_THRESHOLD = "UPDATE committees SET active_arbitrator_count = ?, majority_threshold = ? WHERE chat_id = ?"
+SQL_GET_SUBSCRIPTIONS = "SELECT wiki, title, chat_id FROM page_subscriptions"
+SQL_SUBSCRIBE_PAGE = "INSERT OR IGNORE INTO page_subscriptions (wiki, title, chat_id) VALUES (?, ?, ?)"
+SQL_UNSUBSCRIBE_PAGE = "DELETE FROM page_subscriptions WHERE wiki = ? AND title = ? AND chat_id = ?"
+# Seeding the default committee from the single-committee tables
+SQL_SEED_COMMITTEE = '''
+    INSERT OR IGNORE INTO committees (chat_id, name, archive_channel_id, active_arbitrator_count, majority_threshold)
+    VALUES (?, ?, ?,
+            (SELECT value FROM system_settings WHERE key = 'active_arbitrator_count'),
+            (SELECT value FROM system_settings WHERE key = 'majority_threshold'))
+'''
+SQL_SEED_MEMBERS = "INSERT OR IGNORE INTO committee_members (chat_id, user_id, added_at) SELECT ?, user_id, added_at FROM arbitrators"
+SQL_SET_SETTING = "INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)"
+SQL_GET_SETTING = "SELECT value FROM system_settings WHERE key = ?"
+SQL_GET_ALL_SETTINGS = "SELECT key, value FROM system_settings"
+SQL_CREATE_MOTION = '''
+    INSERT INTO motions (title, content, creator_id, creator_username, chat_id, deadline_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+SQL_GET_ACTIVE_MOTIONS = "SELECT * FROM motions WHERE status = 'active'"
+SQL_GET_ACTIVE_MOTIONS_AFTER = '''
+    SELECT * FROM motions WHERE status = 'active' AND chat_id = ? AND id > ? ORDER BY id LIMIT ?
+'''
+SQL_GET_ACTIVE_MOTIONS_BEFORE = '''
+    SELECT * FROM motions WHERE status = 'active' AND chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+'''
+SQL_GET_MOTION = "SELECT * FROM motions WHERE id = ?"
+SQL_GET_PENDING_DEADLINES = '''
+    SELECT id, deadline_at FROM motions
+    WHERE status = 'active' AND deadline_at IS NOT NULL
+    ORDER BY deadline_at
+'''
+SQL_CLOSE_MOTION = "UPDATE motions SET status = 'closed' WHERE id = ?"
+SQL_CLOSE_ACTIVE_MOTION = "UPDATE motions SET status = 'closed' WHERE id = ? AND status = 'active'"
+SQL_GET_MOTION_TALLY = '''
+    SELECT vote_type, COUNT(*) AS count, group_concat(COALESCE(username, user_id), ', ') AS voters
+    FROM votes WHERE motion_id = ?
+    GROUP BY vote_type
+'''
+# Use REPLACE to update existing vote or insert new one; nothing is written
+# once the motion is no longer active
+SQL_RECORD_VOTE = '''
+    INSERT OR REPLACE INTO votes (motion_id, user_id, username, vote_type)
+    SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM motions WHERE id = ? AND status = 'active')
+'''
+SQL_GET_MOTION_VOTES = "SELECT * FROM votes WHERE motion_id = ?"
+# Search results come straight from the FTS index, ranked by bm25; the join
+# only fetches the matched rows. Snippets mark hits with SNIPPET_START/END.
+# Terms too short for the trigram index are passed as a JSON array of LIKE
+# patterns that every matched motion must also contain.
+SQL_SEARCH_MOTIONS = '''
+    SELECT m.id, m.title, m.status, m.creator_username, m.created_at,
+           snippet(motions_fts, -1, char(2), char(3), '…', 16) AS snippet
+    FROM motions_fts JOIN motions m ON m.id = motions_fts.rowid
+    WHERE motions_fts MATCH ?
+      AND m.chat_id = ?
+      AND NOT EXISTS (SELECT 1 FROM json_each(?) p
+                      WHERE m.title NOT LIKE p.value ESCAPE '\\' AND m.content NOT LIKE p.value ESCAPE '\\')
+      AND (? IS NULL OR m.status = ?)
+      AND (? IS NULL OR m.creator_username = ? COLLATE NOCASE OR m.creator_id = ?)
+      AND (? IS NULL OR m.created_at >= ?)
+      AND (? IS NULL OR m.created_at < date(?, '+1 day'))
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+'''
+# Search with only short terms: a scan of the committee's motions, newest first
+SQL_SEARCH_MOTIONS_SCAN = '''
+    SELECT m.id, m.title, m.content, m.status, m.creator_username, m.created_at
+    FROM motions m
+    WHERE m.chat_id = ?
+      AND NOT EXISTS (SELECT 1 FROM json_each(?) p
+                      WHERE m.title NOT LIKE p.value ESCAPE '\\' AND m.content NOT LIKE p.value ESCAPE '\\')
+      AND (? IS NULL OR m.status = ?)
+      AND (? IS NULL OR m.creator_username = ? COLLATE NOCASE OR m.creator_id = ?)
+      AND (? IS NULL OR m.created_at >= ?)
+      AND (? IS NULL OR m.created_at < date(?, '+1 day'))
+    ORDER BY m.id DESC
+    LIMIT ? OFFSET ?
+'''
+# Shortest term the trigram index can match
+TRIGRAM_MIN_TERM = 3
+# Characters of context shown on each side of a hit in a scan result
+SCAN_SNIPPET_CONTEXT = 8
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+# One row per vote (or one row with NULL vote columns for a motion nobody
+# voted on), grouped by motion so the export can stream it.
+SQL_EXPORT_HISTORY = '''
+    SELECT m.id, m.title, m.content, m.creator_id, m.creator_username, m.chat_id,
+           m.status, m.created_at, m.deadline_at,
+           v.user_id, v.username, v.vote_type, v.voted_at
+    FROM motions m LEFT JOIN votes v ON v.motion_id = m.id
+    ORDER BY m.id
+'''
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_MOTION_FIELDS = ('id', 'title', 'content', 'creator_id', 'creator_username', 'chat_id',
+                        'status', 'created_at', 'deadline_at')
+EXPORT_VOTE_FIELDS = ('user_id', 'username', 'vote_type', 'voted_at')
+SQL_GET_ACTIVE_MOTION_VOTES = '''
+    SELECT * FROM votes
+    WHERE motion_id IN (SELECT id FROM motions WHERE status = 'active')
+    ORDER BY rowid
+'''
+# A message whose dedupe_key is already in the outbox is not queued again
+SQL_INSERT_OUTBOX = '''
+    INSERT OR IGNORE INTO outbox (dedupe_key, chat_id, text, parse_mode, priority)
+    VALUES (?, ?, ?, ?, ?)
+'''
+SQL_GET_DUE_OUTBOX = '''
+    SELECT * FROM outbox WHERE sent_at IS NULL AND dead_at IS NULL AND next_attempt_at <= ?
+    ORDER BY priority, id LIMIT ?
+'''
+SQL_MARK_OUTBOX_SENT = "UPDATE outbox SET sent_at = CURRENT_TIMESTAMP, message_id = ? WHERE id = ?"
+SQL_MARK_OUTBOX_FAILED = '''
+    UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ? WHERE id = ?
+'''
+SQL_MARK_OUTBOX_DEAD = '''
+    UPDATE outbox SET attempts = attempts + 1, last_error = ?, dead_at = CURRENT_TIMESTAMP WHERE id = ?
+'''
+SQL_COUNT_PENDING_OUTBOX = "SELECT COUNT(*) FROM outbox WHERE sent_at IS NULL AND dead_at IS NULL"
+
+# Metric label for each statement above, e.g. "get_motion_tally"; anything
+# else (pragmas, migrations, EXPLAIN) is reported as "other".
+QUERY_NAMES = {sql: name[4:].lower() for name, sql in list(globals().items()) if name.startswith('SQL_')}
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records how long each statement takes to execute."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            db_query_latency.observe(time.perf_counter() - started, QUERY_NAMES.get(sql, 'other'))
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+# Process-wide copies of the committee, page subscription and system_settings
+# tables, loaded once by load_caches() and updated by the write functions after
+# each commit. The containers are replaced rather than mutated, so readers on
+# any thread always see a complete snapshot without taking the lock.
+_cache_lock = threading.Lock()
+_caches_loaded = False
+_settings_cache = {}
+# chat id -> Committee, and user id -> chat ids of the committees they sit on
+_committees = {}
+_user_committees = {}
+# (wiki, title) -> chat ids of the committees following that page
+_page_subscriptions = {}
+_monitored_wikis = frozenset()
+
+# A committee as cached in memory. `members` is a frozenset of user ids; the
+# threshold fields are None until /set_threshold has been used.
+Committee = namedtuple('Committee', [
+    'chat_id', 'name', 'archive_channel_id', 'active_arbitrator_count', 'majority_threshold', 'members'
+])
+
+# Active motions and their live tallies; see motion_store.py.
+active_motions = MotionStore()
+
+# The bot runs all database work on this single worker thread so that handlers
+# never block the event loop while SQLite waits on disk. Work is queued in
+# submission order, which also serialises writes.
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+# Connections opened and closed since startup, reported by /stats
+_connection_lock = threading.Lock()
+_connections_opened = 0
+_connections_closed = 0
+
+def _connect():
+    global _connections_opened
+    conn = sqlite3.connect(DB_NAME, factory=TimedConnection, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    with _connection_lock:
+        _connections_opened += 1
+    return conn
+
 @contextlib.contextmanager
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    """
+    Yields this thread's persistent connection, opening it on first use.
+    Any transaction left open by a failing caller is rolled back.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = _connect()
     try:
         yield conn
-    finally:
+    except Exception:
+        conn.rollback()
+        raise
+
+def close_db_connection():
+    """Closes the calling thread's connection, if it has one."""
+    global _connections_closed
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
         conn.close()
+        with _connection_lock:
+            _connections_closed += 1
+
+def connection_counts():
+    """Returns (opened, closed) connection counts since startup."""
+    return _connections_opened, _connections_closed
+
+async def run_db(func, *args, **kwargs):
+    """
+    Runs a synchronous database function on the DB worker thread and
+    returns its result to the awaiting coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        add_db_time(time.perf_counter() - started)
+
+def shutdown_db_worker():
+    """Closes the worker thread's connection and stops the worker."""
+    _db_executor.submit(close_db_connection)
+    _db_executor.shutdown(wait=True)
+
+# Schema migrations, applied in order. PRAGMA user_version stores how many
+# have run, so each one is applied exactly once. Append new migrations to the
+# end; never edit one that has already shipped.
+MIGRATIONS = [
+    # 1: base tables
+    '''
+        CREATE TABLE IF NOT EXISTS motions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            creator_id INTEGER NOT NULL,
+            creator_username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            chat_id INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS votes (
+            motion_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            vote_type TEXT NOT NULL,
+            voted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (motion_id) REFERENCES motions (id),
+            UNIQUE(motion_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS arbitrators (
+            user_id INTEGER PRIMARY KEY,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS system_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    ''',
+    # 2: indexes for the hot queries. Active motions are a small, stable slice
+    # of the table, so a partial index keeps that lookup independent of how
+    # much history has piled up. Votes are always read per motion, and the
+    # covering index answers those reads and per-option tallies without
+    # touching the table.
+    '''
+        CREATE INDEX IF NOT EXISTS idx_motions_active ON motions (id) WHERE status = 'active';
+        CREATE INDEX IF NOT EXISTS idx_votes_motion_type
+            ON votes (motion_id, vote_type, user_id, username, voted_at);
+    ''',
+    # 3: full-text index over motion titles and content, kept in sync with the
+    # motions table by triggers. The trigram tokenizer matches substrings,
+    # which works for Chinese text that has no spaces between words.
+    '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS motions_fts USING fts5(
+            title, content, content='motions', content_rowid='id', tokenize='trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS motions_fts_insert AFTER INSERT ON motions BEGIN
+            INSERT INTO motions_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS motions_fts_delete AFTER DELETE ON motions BEGIN
+            INSERT INTO motions_fts (motions_fts, rowid, title, content)
+            VALUES ('delete', old.id, old.title, old.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS motions_fts_update AFTER UPDATE OF title, content ON motions BEGIN
+            INSERT INTO motions_fts (motions_fts, rowid, title, content)
+            VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO motions_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END;
+        INSERT INTO motions_fts (motions_fts) VALUES ('rebuild');
+    ''',
+    # 4: optional voting deadline (UTC, same format as created_at), with an
+    # index holding only the motions still waiting for one
+    '''
+        ALTER TABLE motions ADD COLUMN deadline_at TIMESTAMP;
+        CREATE INDEX IF NOT EXISTS idx_motions_deadline
+            ON motions (deadline_at) WHERE status = 'active' AND deadline_at IS NOT NULL;
+    ''',
+    # 5: messages waiting to be sent, written in the same transaction as the
+    # change they announce and drained by outbox.py. next_attempt_at is a
+    # Unix time; sent rows are kept as a delivery record.
+    '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dedupe_key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            priority INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            sent_at TIMESTAMP,
+            message_id INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (priority, id) WHERE sent_at IS NULL;
+    ''',
+    # 6: committees, one per group chat, each with its own roster, threshold,
+    # archive channel and monitored pages. The arbitrators table and the
+    # threshold settings are only read to seed the default committee.
+    '''
+        CREATE TABLE IF NOT EXISTS committees (
+            chat_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            archive_channel_id INTEGER NOT NULL,
+            active_arbitrator_count INTEGER,
+            majority_threshold INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS committee_members (
+            chat_id INTEGER NOT NULL REFERENCES committees (chat_id),
+            user_id INTEGER NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS page_subscriptions (
+            wiki TEXT NOT NULL,
+            title TEXT NOT NULL,
+            chat_id INTEGER NOT NULL REFERENCES committees (chat_id),
+            PRIMARY KEY (wiki, title, chat_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_motions_active_chat ON motions (chat_id, id) WHERE status = 'active';
+    ''',
+    # 7: outbox messages given up on (a permanent error or too many attempts)
+    # are kept with dead_at set and no longer count as pending
+    '''
+        ALTER TABLE outbox ADD COLUMN dead_at TIMESTAMP;
+        DROP INDEX IF EXISTS idx_outbox_pending;
+        CREATE INDEX idx_outbox_pending ON outbox (priority, id) WHERE sent_at IS NULL AND dead_at IS NULL;
+    ''',
+    # 8: a committee's motions in id order, for searches the trigram index
+    # cannot answer
+    '''
+        CREATE INDEX IF NOT EXISTS idx_motions_chat ON motions (chat_id, id);
+    ''',
+]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Applies any pending migrations, each in its own transaction."""
+    version = get_schema_version(conn)
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.executescript(f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;")
+        print(f"Applied database migration {number}.")
 
 def init_db():
+    with get_db_connection() as conn:
+        migrate(conn)
+        print("Database initialized successfully.")
+
+def explain_queries():
+    """Prints the query plan of every SQL_* statement in this module."""
+    with get_db_connection() as conn:
+        for name, sql in sorted(globals().items()):
+            if not name.startswith('SQL_'):
+                continue
+            print(f"{name}:")
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * sql.count('?')):
+                print(f"    {row['detail']}")
+
+def load_caches():
+    """
+    (Re)loads the arbitrator and settings caches and the active motion store
+    from the database. Changes made to the file by another process are only
+    seen after calling this.
+    """
+    global _caches_loaded, _settings_cache
+    with get_db_connection() as conn:
+        members = {}
+        for row in conn.execute(SQL_GET_ALL_MEMBERS):
+            members.setdefault(row['chat_id'], set()).add(row['user_id'])
+        committees = {
+            row['chat_id']: _committee_from_row(row, frozenset(members.get(row['chat_id'], ())))
+            for row in conn.execute(SQL_GET_COMMITTEES)
+        }
+        subscriptions = {}
+        for row in conn.execute(SQL_GET_SUBSCRIPTIONS):
+            subscriptions.setdefault((row['wiki'], row['title']), []).append(row['chat_id'])
+        settings = {row['key']: row['value'] for row in conn.execute(SQL_GET_ALL_SETTINGS)}
+        active_motions.hydrate(
+            conn.execute(SQL_GET_ACTIVE_MOTIONS).fetchall(),
+            conn.execute(SQL_GET_ACTIVE_MOTION_VOTES).fetchall()
+        )
+    with _cache_lock:
+        _publish_committees(committees)
+        _publish_subscriptions({key: tuple(chat_ids) for key, chat_ids in subscriptions.items()})
+        _settings_cache = settings
+        _caches_loaded = True
+
+def _ensure_caches():
+    if not _caches_loaded:
+        load_caches()
+
+def _committee_from_row(row, members):
+    return Committee(
+        row['chat_id'], row['name'], row['archive_channel_id'],
+        row['active_arbitrator_count'], row['majority_threshold'], members
+    )
+
+def _publish_committees(committees):
+    """Swaps in a new committee map and its user index. Call with _cache_lock held."""
+    global _committees, _user_committees
+    by_user = {}
+    for committee in committees.values():
+        for user_id in committee.members:
+            by_user.setdefault(user_id, []).append(committee.chat_id)
+    _committees = committees
+    _user_committees = {user_id: tuple(chat_ids) for user_id, chat_ids in by_user.items()}
+
+def _update_committee(chat_id, change):
+    """Replaces a cached committee with change(committee)."""
+    with _cache_lock:
+        committee = _committees.get(chat_id)
+        if committee is not None:
+            _publish_committees({**_committees, chat_id: change(committee)})
+
+def _publish_subscriptions(subscriptions):
+    """Swaps in a new page subscription map. Call with _cache_lock held."""
+    global _page_subscriptions, _monitored_wikis
+    _page_subscriptions = subscriptions
+    _monitored_wikis = frozenset(wiki for wiki, _ in subscriptions)
+
+# Committee functions
+def add_committee_db(chat_id, name, archive_channel_id):
+    """
+    Registers a group chat as a committee, or updates the name and archive
+    channel of an existing one. Returns True if the committee is new.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        
-        # Motions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS motions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                creator_id INTEGER NOT NULL,
-                creator_username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'active',
-                chat_id INTEGER NOT NULL
-            )
-        ''')
-        
-        # Votes table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS votes (
-                motion_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                vote_type TEXT NOT NULL,
-                voted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (motion_id) REFERENCES motions (id),
-                UNIQUE(motion_id, user_id)
-            )
-        ''')
-        
-        # Arbitrators table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS arbitrators (
-                user_id INTEGER PRIMARY KEY,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # System Settings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        ''')
-        
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(SQL_GET_COMMITTEE, (chat_id,))
+        created = cursor.fetchone() is None
+        cursor.execute(SQL_UPSERT_COMMITTEE, (chat_id, name, archive_channel_id))
+        cursor.execute(SQL_GET_COMMITTEE, (chat_id,))
+        row = cursor.fetchone()
         conn.commit()
-        print("Database initialized successfully.")
+    with _cache_lock:
+        old = _committees.get(chat_id)
+        _publish_committees({**_committees, chat_id: _committee_from_row(row, old.members if old else frozenset())})
+    return created
+
+def seed_default_committee_db(chat_id, name, archive_channel_id, wiki, titles):
+    """
+    Creates the committee for the group configured in config.json, carrying
+    over the arbitrators and threshold of the single-committee tables and
+    subscribing it to `titles` on `wiki`. Does nothing once that committee
+    exists. Returns True if it was created.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(SQL_SEED_COMMITTEE, (chat_id, name, archive_channel_id))
+        created = cursor.rowcount > 0
+        if created:
+            cursor.execute(SQL_SEED_MEMBERS, (chat_id,))
+            for title in titles:
+                cursor.execute(SQL_SUBSCRIBE_PAGE, (wiki, title, chat_id))
+        conn.commit()
+    if created:
+        load_caches()
+    return created
 
-def add_arbitrator_db(user_id):
+def get_committee(chat_id):
+    """Returns the Committee for a group chat, or None. Answered from memory."""
+    _ensure_caches()
+    return _committees.get(chat_id)
+
+def get_user_committees(user_id):
+    """Returns the committees a user sits on. Answered from memory."""
+    _ensure_caches()
+    return [_committees[chat_id] for chat_id in _user_committees.get(user_id, ())]
+
+def add_arbitrator_db(chat_id, user_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         try:
-            cursor.execute("INSERT INTO arbitrators (user_id) VALUES (?)", (user_id,))
+            cursor.execute(SQL_ADD_ARBITRATOR, (chat_id, user_id))
             conn.commit()
-            return True
         except sqlite3.IntegrityError:
+            conn.rollback()
             return False
+    _update_committee(chat_id, lambda c: c._replace(members=c.members | {user_id}))
+    return True
 
-def remove_arbitrator_db(user_id):
+def remove_arbitrator_db(chat_id, user_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM arbitrators WHERE user_id = ?", (user_id,))
+        cursor.execute(SQL_REMOVE_ARBITRATOR, (chat_id, user_id))
         conn.commit()
-        return cursor.rowcount > 0
+    _update_committee(chat_id, lambda c: c._replace(members=c.members - {user_id}))
+    return cursor.rowcount > 0
 
-def get_all_arbitrators_db():
+def get_all_arbitrators_db(chat_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT user_id FROM arbitrators")
+        cursor.execute(SQL_GET_ALL_ARBITRATORS, (chat_id,))
         return [row['user_id'] for row in cursor.fetchall()]
 
+def is_arbitrator_db(user_id, chat_id=None):
+    """
+    Whether the user sits on the committee of `chat_id`, or on any committee
+    if it is None. Answered from the in-memory cache; never touches the disk
+    once loaded.
+    """
+    _ensure_caches()
+    if chat_id is None:
+        return user_id in _user_committees
+    return chat_id in _user_committees.get(user_id, ())
+
+def set_threshold_db(chat_id, active_count, majority_threshold, outbox=()):
+    """
+    Sets a committee's active arbitrator count and majority threshold and
+    queues `outbox` messages (OutboxMessage tuples) in one transaction, so
+    the announcement exists if and only if the change does.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(SQL_SET_THRESHOLD, (active_count, majority_threshold, chat_id))
+        _queue_outbox(cursor, outbox)
+        conn.commit()
+    _update_committee(chat_id, lambda c: c._replace(
+        active_arbitrator_count=active_count, majority_threshold=majority_threshold
+    ))
+
+# Monitored pages
+def subscribe_page_db(chat_id, wiki, title):
+    """Makes the monitor report edits to a page to a committee. Returns False if it already did."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_SUBSCRIBE_PAGE, (wiki, title, chat_id))
+        conn.commit()
+    if cursor.rowcount == 0:
+        return False
+    with _cache_lock:
+        chat_ids = _page_subscriptions.get((wiki, title), ())
+        _publish_subscriptions({**_page_subscriptions, (wiki, title): chat_ids + (chat_id,)})
+    return True
+
+def unsubscribe_page_db(chat_id, wiki, title):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_UNSUBSCRIBE_PAGE, (wiki, title, chat_id))
+        conn.commit()
+    if cursor.rowcount == 0:
+        return False
+    with _cache_lock:
+        subscriptions = dict(_page_subscriptions)
+        chat_ids = tuple(c for c in subscriptions.pop((wiki, title), ()) if c != chat_id)
+        if chat_ids:
+            subscriptions[(wiki, title)] = chat_ids
+        _publish_subscriptions(subscriptions)
+    return True
+
+def get_page_subscribers(wiki, title):
+    """Returns the chat ids of the committees following a page. Answered from memory."""
+    _ensure_caches()
+    return _page_subscriptions.get((wiki, title), ())
+
+def get_monitored_wikis():
+    """Returns the set of wikis with at least one followed page. Answered from memory."""
+    _ensure_caches()
+    return _monitored_wikis
+
+def get_committee_pages(chat_id):
+    """Returns the (wiki, title) pairs a committee follows."""
+    _ensure_caches()
+    return sorted(key for key, chat_ids in _page_subscriptions.items() if chat_id in chat_ids)
+
 # System Settings functions
 def set_setting_db(key, value):
+    global _settings_cache
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", (key, str(value)))
+        cursor.execute(SQL_SET_SETTING, (key, str(value)))
         conn.commit()
+    with _cache_lock:
+        _settings_cache = {**_settings_cache, key: str(value)}
 
 def get_setting_db(key, default=None):
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM system_settings WHERE key = ?", (key,))
-        row = cursor.fetchone()
-        return row['value'] if row else default
+    """Answered from the in-memory cache; never touches the disk once loaded."""
+    _ensure_caches()
+    return _settings_cache.get(key, default)
 
 # Motion related functions
-def create_motion_db(title, content, creator_id, creator_username, chat_id):
+def create_motion_db(title, content, creator_id, creator_username, chat_id, deadline_at=None):
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO motions (title, content, creator_id, creator_username, chat_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (title, content, creator_id, creator_username, chat_id))
+        cursor.execute(SQL_CREATE_MOTION, (title, content, creator_id, creator_username, chat_id, deadline_at))
         conn.commit()
-        return cursor.lastrowid
+        motion_id = cursor.lastrowid
+        cursor.execute(SQL_GET_MOTION, (motion_id,))
+        active_motions.add(cursor.fetchone())
+        return motion_id
+
+def get_active_motions_page_db(chat_id, after_id=0, before_id=None, limit=MOTIONS_PAGE_SIZE):
+    """
+    Returns one page of a committee's active motions in id order, as (rows,
+    has_prev, has_next). Pages are keyed on motion id: pass the last id of the current
+    page as `after_id` for the next page, or its first id as `before_id` for
+    the previous one. One extra row is fetched to tell whether more follow.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if before_id is not None:
+            cursor.execute(SQL_GET_ACTIVE_MOTIONS_BEFORE, (chat_id, before_id, limit + 1))
+            rows = cursor.fetchall()
+            return rows[:limit][::-1], len(rows) > limit, True
+        cursor.execute(SQL_GET_ACTIVE_MOTIONS_AFTER, (chat_id, after_id, limit + 1))
+        rows = cursor.fetchall()
+        return rows[:limit], after_id > 0, len(rows) > limit
 
-def get_active_motions_db():
+def get_pending_deadlines_db():
+    """Returns (id, deadline_at) of every active motion that has a deadline."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM motions WHERE status = 'active'")
+        cursor.execute(SQL_GET_PENDING_DEADLINES)
         return cursor.fetchall()
 
 def get_motion_db(motion_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM motions WHERE id = ?", (motion_id,))
+        cursor.execute(SQL_GET_MOTION, (motion_id,))
         return cursor.fetchone()
 
 def close_motion_db(motion_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE motions SET status = 'closed' WHERE id = ?", (motion_id,))
+        cursor.execute(SQL_CLOSE_MOTION, (motion_id,))
+        conn.commit()
+    active_motions.remove(motion_id)
+    return cursor.rowcount > 0
+
+# Outcome of close_motion_tx: `won` is True only for the call that actually
+# flipped the motion from active to closed. `motion` is None if it does not
+# exist; `tallies` and `voters` map each vote type to its count and to a
+# comma-separated list of voter names.
+CloseResult = namedtuple('CloseResult', ['won', 'motion', 'tallies', 'voters'])
+
+def close_motion_tx(motion_id, outbox=None):
+    """
+    Closes a motion if it is still active and reads its final tally, all in
+    one transaction. Of several concurrent callers exactly one gets won=True,
+    so the result is archived exactly once. For that caller, `outbox(result)`
+    is called inside the transaction and the OutboxMessages it returns are
+    queued with the close.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(SQL_CLOSE_ACTIVE_MOTION, (motion_id,))
+        won = cursor.rowcount > 0
+        cursor.execute(SQL_GET_MOTION, (motion_id,))
+        motion = cursor.fetchone()
+        tallies, voters = {}, {}
+        for row in cursor.execute(SQL_GET_MOTION_TALLY, (motion_id,)):
+            tallies[row['vote_type']] = row['count']
+            voters[row['vote_type']] = row['voters']
+        result = CloseResult(won, motion, tallies, voters)
+        if won and outbox is not None:
+            _queue_outbox(cursor, outbox(result))
         conn.commit()
-        return cursor.rowcount > 0
+    if won:
+        active_motions.remove(motion_id)
+    return result
+
+# Outbox functions
+
+# A message to send after the transaction queueing it commits. `dedupe_key`
+# identifies it, e.g. "motion:12:archive"; queueing the same key twice sends
+# it once.
+OutboxMessage = namedtuple('OutboxMessage', ['dedupe_key', 'chat_id', 'text', 'parse_mode', 'priority'])
+
+def _queue_outbox(cursor, messages):
+    for message in messages:
+        cursor.execute(SQL_INSERT_OUTBOX, tuple(message))
+
+def get_due_outbox_db(now, limit):
+    """Returns up to `limit` unsent messages whose next attempt is due, most urgent first."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_GET_DUE_OUTBOX, (now, limit))
+        return cursor.fetchall()
+
+def mark_outbox_db(sent, failed, dead=()):
+    """
+    Records one drained batch in a single transaction: `sent` holds
+    (message_id, id) pairs, `failed` holds (error, next_attempt_at, id) and
+    `dead` holds (error, id) of messages that will not be retried.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(SQL_MARK_OUTBOX_SENT, sent)
+        cursor.executemany(SQL_MARK_OUTBOX_FAILED, failed)
+        cursor.executemany(SQL_MARK_OUTBOX_DEAD, dead)
+        conn.commit()
+
+def count_pending_outbox_db():
+    with get_db_connection() as conn:
+        return conn.execute(SQL_COUNT_PENDING_OUTBOX).fetchone()[0]
+
+def search_motions_db(terms, chat_id, status=None, creator=None, date_from=None, date_to=None,
+                      limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    Full-text search over the titles and content of a committee's motions.
+    Every term must occur as a substring. Terms of TRIGRAM_MIN_TERM or more
+    characters go through the FTS index and rank the results; shorter ones,
+    such as most two-character Chinese words, are matched with LIKE on the
+    rows found. With only short terms the committee's motions are scanned
+    newest first. Returns (rows, has_more).
+    """
+    long_terms = [term for term in terms if len(term) >= TRIGRAM_MIN_TERM]
+    patterns = json.dumps([
+        '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        for term in terms if len(term) < TRIGRAM_MIN_TERM
+    ])
+    filters = (status, status, creator, creator, creator, date_from, date_from, date_to, date_to, limit + 1, offset)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if long_terms:
+            query = ' '.join('"' + term.replace('"', '""') + '"' for term in long_terms)
+            cursor.execute(SQL_SEARCH_MOTIONS, (query, chat_id, patterns, *filters))
+            rows = cursor.fetchall()
+        else:
+            cursor.execute(SQL_SEARCH_MOTIONS_SCAN, (chat_id, patterns, *filters))
+            rows = [dict(row, snippet=_scan_snippet(row, terms)) for row in cursor]
+        return rows[:limit], len(rows) > limit
+
+def _scan_snippet(row, terms):
+    """
+    Builds a snippet like the FTS one for a scanned row: the text around the
+    first hit, with every hit marked by SNIPPET_START/END.
+    """
+    text = row['content']
+    lowered = text.lower()
+    hits = [i for i in (lowered.find(term.lower()) for term in terms) if i >= 0]
+    if not hits:
+        text = row['title']
+        lowered = text.lower()
+        hits = [i for i in (lowered.find(term.lower()) for term in terms) if i >= 0] or [0]
+    start = max(0, min(hits) - SCAN_SNIPPET_CONTEXT)
+    end = min(len(text), min(hits) + SCAN_SNIPPET_CONTEXT * 2)
+    snippet = text[start:end]
+    for term in terms:
+        snippet = re.sub(re.escape(term), lambda m: SNIPPET_START + m.group() + SNIPPET_END, snippet, flags=re.IGNORECASE)
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(text) else '')
+
+# Export
+def iter_history():
+    """
+    Yields (motion, votes) for every motion, oldest first, reading the
+    joined rows from a single cursor so only one motion is held at a time.
+    """
+    split = len(EXPORT_MOTION_FIELDS)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # Plain tuples: much cheaper than sqlite3.Row over millions of rows
+        cursor.row_factory = None
+        cursor.execute(SQL_EXPORT_HISTORY)
+        motion, votes = None, []
+        for row in cursor:
+            if motion is None or row[0] != motion['id']:
+                if motion is not None:
+                    yield motion, votes
+                motion = dict(zip(EXPORT_MOTION_FIELDS, row[:split]))
+                votes = []
+            if row[split] is not None:
+                votes.append(dict(zip(EXPORT_VOTE_FIELDS, row[split:])))
+        if motion is not None:
+            yield motion, votes
+
+def export_history(path, fmt='jsonl'):
+    """
+    Writes the motion and vote history to a gzip-compressed file as it is
+    read: JSONL with one motion (and its votes) per line, or CSV with one
+    row per vote. Returns the number of motions written.
+    """
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_MOTION_FIELDS + EXPORT_VOTE_FIELDS)
+        for motion, votes in iter_history():
+            if fmt == 'csv':
+                fields = [motion[field] for field in EXPORT_MOTION_FIELDS]
+                for vote in votes or [dict.fromkeys(EXPORT_VOTE_FIELDS)]:
+                    writer.writerow(fields + [vote[field] for field in EXPORT_VOTE_FIELDS])
+            else:
+                f.write(json.dumps({**motion, 'votes': votes}, ensure_ascii=False) + '\n')
+            count += 1
+    return count
 
 # Vote related functions
 def record_vote_db(motion_id, user_id, username, vote_type):
+    """
+    Records a vote and returns the motion's updated tallies, or None if the
+    motion is not active.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        # Use REPLACE to update existing vote or insert new one
-        cursor.execute('''
-            INSERT OR REPLACE INTO votes (motion_id, user_id, username, vote_type)
-            VALUES (?, ?, ?, ?)
-        ''', (motion_id, user_id, username, vote_type))
+        cursor.execute(SQL_RECORD_VOTE, (motion_id, user_id, username, vote_type, motion_id))
         conn.commit()
+    if cursor.rowcount == 0:
+        return None
+    return active_motions.apply_vote(motion_id, user_id, username, vote_type)
+
+def get_active_motion(motion_id):
+    """Returns an active motion's row from memory, or None if it is not active."""
+    _ensure_caches()
+    return active_motions.get_motion(motion_id)
+
+def get_motion_tallies(motion_id):
+    """Returns a copy of an active motion's tallies, or None if it is not active."""
+    _ensure_caches()
+    return active_motions.get_tallies(motion_id)
 
 def get_motion_votes_db(motion_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM votes WHERE motion_id = ?", (motion_id,))
+        cursor.execute(SQL_GET_MOTION_VOTES, (motion_id,))
         return cursor.fetchall()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the bot database.")
+    parser.add_argument('command', nargs='?', default='init', choices=['init', 'explain', 'export'],
+                        help="init: create or migrate the schema (default); explain: print query plans; "
+                             "export: write the motion and vote history to a .gz file")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help="export format (default jsonl)")
+    parser.add_argument('--output', help="export file (default motions-<date>.<format>.gz)")
+    args = parser.parse_args()
+
     init_db()
+    if args.command == 'explain':
+        explain_queries()
+    elif args.command == 'export':
+        output = args.output or f"motions-{time.strftime('%Y%m%d')}.{args.format}.gz"
+        print(f"Exported {export_history(output, args.format)} motions to {output}.")
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from motion_store import VOTE_TYPES
+from database import active_motions
+from utils import build_vote_keyboard, retry_after_seconds
+
+# How long to gather votes on one message before editing its keyboard
+EDIT_WINDOW = 1.0
+# How many messages to remember the last shown tallies for
+MAX_REMEMBERED = 1024
+
+class KeyboardUpdater:
+    """
+    Coalesces vote keyboard edits per message. Tally changes arriving within
+    EDIT_WINDOW of each other are merged into a single edit that carries the
+    latest counts, so a burst of votes costs one API call instead of one per
+    click and stays under Telegram's per-chat edit limits.
+    """
+
+    def __init__(self, window=EDIT_WINDOW):
+        self.window = window
+        self._pending = {}
+        self._tasks = {}
+        self._shown = OrderedDict()
+
+    def remember(self, chat_id, message_id, tallies):
+        """Records the tallies a message currently displays."""
+        key = (chat_id, message_id)
+        self._shown[key] = _shown_counts(tallies)
+        self._shown.move_to_end(key)
+        while len(self._shown) > MAX_REMEMBERED:
+            self._shown.popitem(last=False)
+
+    def schedule(self, bot, chat_id, message_id, motion_id, tallies):
+        """
+        Queues an edit showing `tallies`. Returns immediately; the edit is sent
+        once the window has passed, replacing any older pending counts.
+        """
+        key = (chat_id, message_id)
+        self._pending[key] = (motion_id, tallies)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._flush_later(bot, key))
+
+    async def _flush_later(self, bot, key):
+        chat_id, message_id = key
+        try:
+            while key in self._pending:
+                await asyncio.sleep(self.window)
+                motion_id, tallies = self._pending.pop(key)
+                # A schedule() from an older vote may have landed last; the
+                # live counts win while the motion is active
+                live = active_motions.get_tallies(motion_id)
+                if live is not None:
+                    tallies = live
+                if self._shown.get(key) == _shown_counts(tallies):
+                    continue
+                try:
+                    await bot.edit_message_reply_markup(
+                        chat_id, message_id,
+                        reply_markup=build_vote_keyboard(motion_id, tallies)
+                    )
+                    self.remember(chat_id, message_id, tallies)
+                except RetryAfter as e:
+                    # Keep these counts unless a newer vote already replaced them
+                    self._pending.setdefault(key, (motion_id, tallies))
+                    await asyncio.sleep(retry_after_seconds(e))
+                except BadRequest as e:
+                    if 'not modified' in str(e).lower():
+                        self.remember(chat_id, message_id, tallies)
+                    else:
+                        logging.warning(f"Failed to update keyboard of message {message_id} in {chat_id}: {e}")
+                except TelegramError as e:
+                    logging.warning(f"Failed to update keyboard of message {message_id} in {chat_id}: {e}")
+        finally:
+            self._tasks.pop(key, None)
+
+def _shown_counts(tallies):
+    return tuple(tallies.get(vote_type, 0) for vote_type in VOTE_TYPES)
+
+keyboard_updater = KeyboardUpdater()
@@ -0,0 +1,33 @@
+import asyncio
+import contextlib
+
+class KeyedLock:
+    """
+    One asyncio lock per key, created on first use and dropped again once
+    nobody holds or waits for it. Coroutines using the same key run one at a
+    time; different keys never wait on each other.
+    """
+
+    def __init__(self):
+        # key -> [lock, number of holders and waiters]
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+# Serialises vote, close and auto-close handling per motion id
+motion_locks = KeyedLock()
@@ -0,0 +1,427 @@
+"""
+End-to-end load test of the vote path: vote_callback, the database, the
+keyboard edit and the auto-close in execute_close_motion.
+
+A local HTTP server stands in for the Telegram Bot API (getUpdates,
+answerCallbackQuery, editMessageReplyMarkup, sendMessage, ...) and can answer
+a share of requests with 429 flood-wait errors. The real Application from
+bot.build_application() polls it, while scripted arbitrators click vote
+buttons on several motions at once. With `--delivery webhook` the updates are
+instead POSTed to the bot's webhook endpoint, set up from bot.webhook_options()
+as in webhook mode, and requests with a wrong secret token must be refused.
+
+Updates are handled concurrently, so every run also checks the outcome for
+interleaving bugs: each closed motion is archived exactly once, the archived
+tallies equal the votes stored for it, every accepted vote is stored and
+none is accepted after the close, and each auto-close is justified by the
+tallies it archived. `--revote-share` makes arbitrators change their vote
+right after casting it, so votes on one motion race each other and the close.
+
+Run it from the bot directory, since bot.py loads config.json on import:
+
+    python loadtest_votes.py --arbitrators 15 --motions 5
+    python loadtest_votes.py --arbitrators 15 --motions 20 --rate-429 0.05
+    python loadtest_votes.py --delivery webhook
+    python loadtest_votes.py --motions 3 --revote-share 0.5 --interval 0
+
+Reported latency is from the moment an update is handed out by getUpdates (or
+posted to the webhook) to the matching answerCallbackQuery, i.e. what a clicking arbitrator waits for.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+import httpx
+
+import database
+
+class FakeBotAPI:
+    """Minimal HTTP/1.1 server speaking enough of the Bot API for the bot."""
+
+    def __init__(self, rate_429=0.0, retry_after=1, seed=1):
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.updates = []
+        self.update_event = asyncio.Event()
+        self.handed_out = {}
+        self.answered = {}
+        self.answer_texts = {}
+        self.messages = []
+        self.calls = Counter()
+        self.flood_waits = Counter()
+        self.next_message_id = 1000
+        self.port = None
+
+    async def start(self):
+        server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self.server = server
+
+    def push(self, update):
+        self.updates.append(update)
+        self.update_event.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method = request_line.split()[1].rsplit('/', 1)[-1]
+                params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+                status, payload = await self._dispatch(method, params)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, params):
+        self.calls[method] += 1
+        if method in ('sendMessage', 'editMessageReplyMarkup') and self.rng.random() < self.rate_429:
+            self.flood_waits[method] += 1
+            return 429, {
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }
+        handler = getattr(self, f"api_{method}", None)
+        result = await handler(params) if handler else True
+        return 200, {'ok': True, 'result': result}
+
+    async def api_getMe(self, params):
+        return {'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'loadtest_bot'}
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get('offset', 0))
+        timeout = float(params.get('timeout', 0))
+        pending = [u for u in self.updates if u['update_id'] >= offset]
+        if not pending and timeout:
+            self.update_event.clear()
+            try:
+                await asyncio.wait_for(self.update_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            pending = [u for u in self.updates if u['update_id'] >= offset]
+        self.updates = pending
+        now = time.perf_counter()
+        for update in pending:
+            query = update.get('callback_query')
+            if query and query['id'] not in self.handed_out:
+                self.handed_out[query['id']] = now
+        return pending
+
+    async def api_answerCallbackQuery(self, params):
+        self.answered[params['callback_query_id']] = time.perf_counter()
+        self.answer_texts[params['callback_query_id']] = params.get('text', '')
+        return True
+
+    async def api_sendMessage(self, params):
+        self.next_message_id += 1
+        self.messages.append((int(params['chat_id']), params.get('text', '')))
+        return {
+            'message_id': self.next_message_id, 'date': int(time.time()),
+            'chat': {'id': int(params['chat_id']), 'type': 'supergroup', 'title': 'Load test'},
+            'text': params.get('text', ''),
+        }
+
+    async def api_editMessageReplyMarkup(self, params):
+        return True
+
+def callback_update(update_id, user_id, chat_id, message_id, motion_id, vote_type):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': f"cq-{update_id}",
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Arb{user_id}", 'username': f"arb{user_id}"},
+            'chat_instance': str(chat_id),
+            'data': f"vote:{motion_id}:{vote_type}",
+            'message': {
+                'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Load test'},
+                'text': f"Motion #{motion_id}",
+            },
+        },
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class WebhookPoster:
+    """Delivers updates the way Telegram does in webhook mode."""
+
+    def __init__(self, api, options):
+        self.api = api
+        self.url = f"http://{options['listen']}:{options['port']}/{options['url_path']}"
+        self.secret = options['secret_token']
+        self.client = httpx.AsyncClient()
+        self.posts = set()
+        self.rejected = Counter()
+
+    def push(self, update):
+        task = asyncio.create_task(self._post(update))
+        self.posts.add(task)
+        task.add_done_callback(self.posts.discard)
+
+    async def _post(self, update):
+        self.api.handed_out[update['callback_query']['id']] = time.perf_counter()
+        response = await self.client.post(self.url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': self.secret})
+        if response.status_code != 200:
+            self.rejected[response.status_code] += 1
+
+    async def check_secret(self):
+        """Returns True if a post with a wrong secret token is refused."""
+        response = await self.client.post(self.url, json={'update_id': 0}, headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+        return response.status_code == 403
+
+    async def close(self):
+        await asyncio.gather(*self.posts, return_exceptions=True)
+        await self.client.aclose()
+
+ARCHIVE_HEADER = re.compile(r"動議 #(\d+) 已關閉")
+ARCHIVE_TALLY = {vote_type: re.compile(label + r" \((\d+)\)") for vote_type, label in
+                 (('support', '支持'), ('oppose', '反對'), ('abstain', '棄權'))}
+
+def check_consistency(api, archive_chat, votes_cast, arbitrators, threshold):
+    """
+    Compares what the bot archived and acknowledged with what the database
+    holds. `votes_cast` maps callback query id to (motion_id, user_id).
+    Returns a list of problems; empty means consistent.
+    """
+    problems = []
+    archived = Counter()
+    archived_tallies = {}
+    for chat_id, text in api.messages:
+        header = ARCHIVE_HEADER.search(text)
+        if chat_id != archive_chat or not header:
+            continue
+        motion_id = int(header.group(1))
+        archived[motion_id] += 1
+        tallies = archived_tallies[motion_id] = {
+            vote_type: int(match.group(1)) if (match := pattern.search(text)) else 0
+            for vote_type, pattern in ARCHIVE_TALLY.items()
+        }
+        # The reason for a failed motion also contains the one for a passed one
+        if "無法達到" in text:
+            if tallies['support'] + arbitrators - sum(tallies.values()) >= threshold:
+                problems.append(f"motion #{motion_id} failed while the threshold was still reachable")
+        elif "達到絕對多數門檻" in text and tallies['support'] < threshold:
+            problems.append(f"motion #{motion_id} passed without reaching the threshold")
+
+    accepted = {}
+    for cq_id, (motion_id, user_id) in votes_cast.items():
+        if api.answer_texts.get(cq_id, '').startswith("投票已記錄"):
+            accepted.setdefault(motion_id, set()).add(user_id)
+
+    for motion_id in {m for m, _ in votes_cast.values()}:
+        stored = database.get_motion_votes_db(motion_id)
+        stored_users = {row['user_id'] for row in stored}
+        if stored_users != accepted.get(motion_id, set()):
+            problems.append(f"motion #{motion_id}: {len(accepted.get(motion_id, ()))} voters acknowledged, {len(stored_users)} stored")
+        motion = database.get_motion_db(motion_id)
+        if motion['status'] == 'closed':
+            if archived[motion_id] != 1:
+                problems.append(f"motion #{motion_id} archived {archived[motion_id]} times")
+            else:
+                stored_tallies = {t: sum(1 for row in stored if row['vote_type'] == t) for t in ARCHIVE_TALLY}
+                if archived_tallies[motion_id] != stored_tallies:
+                    problems.append(f"motion #{motion_id}: archived {archived_tallies[motion_id]}, stored {stored_tallies}")
+        elif archived[motion_id]:
+            problems.append(f"motion #{motion_id} archived but still active")
+    return problems
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def print_histogram(values_ms, buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2500)):
+    counts = Counter()
+    for value in values_ms:
+        counts[next((b for b in buckets if value <= b), float('inf'))] += 1
+    width = max(counts.values(), default=1)
+    for bound in (*buckets, float('inf')):
+        label = f"<= {bound:g} ms" if bound != float('inf') else f"> {buckets[-1]:g} ms"
+        bar = '#' * round(40 * counts[bound] / width)
+        print(f"  {label:>12} {counts[bound]:6d} {bar}")
+
+async def run(args):
+    import bot
+    import outbound
+    import outbox
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    config = bot.config
+    chat_id = config['arbcom_group_id']
+    rng = random.Random(args.seed)
+
+    # Scripted committee with an auto-close threshold
+    bot.seed_default_committee()
+    arbitrators = [10_000 + i for i in range(args.arbitrators)]
+    for user_id in arbitrators:
+        database.add_arbitrator_db(chat_id, user_id)
+    threshold = args.threshold or args.arbitrators // 2 + 1
+    database.set_threshold_db(chat_id, args.arbitrators, threshold)
+    motions = {}
+    for i in range(args.motions):
+        motion_id = database.create_motion_db(f"Load test {i}", "content", arbitrators[0], "arb", chat_id)
+        motions[motion_id] = 500 + i
+
+    api = FakeBotAPI(rate_429=args.rate_429, seed=args.seed)
+    await api.start()
+
+    # Count database round-trips made by the handlers
+    db_calls = Counter()
+    real_run_db = bot.run_db
+
+    async def counting_run_db(func, *a, **kw):
+        db_calls[func.__name__] += 1
+        return await real_run_db(func, *a, **kw)
+
+    bot.run_db = counting_run_db
+
+    errors = Counter()
+
+    async def on_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application = bot.build_application(base_url=f"http://127.0.0.1:{api.port}/bot")
+    application.add_error_handler(on_error)
+    await application.initialize()
+    outbound.dispatcher.start(application.bot)
+    outbox.outbox_drainer.start()
+    await application.start()
+    if args.delivery == 'webhook':
+        port = free_port()
+        os.environ['ARBCOM_BOT_WEBHOOK'] = json.dumps({
+            'url': f"http://127.0.0.1:{port}", 'listen': '127.0.0.1', 'port': port,
+            'secret_token': 'loadtest-secret',
+        })
+        config.reload()
+        options = bot.webhook_options()
+        await application.updater.start_webhook(allowed_updates=bot.Update.ALL_TYPES, **options)
+        source = WebhookPoster(api, options)
+        secret_checked = await source.check_secret()
+    else:
+        await application.updater.start_polling(poll_interval=0.0, timeout=1)
+        source = api
+
+    # Every arbitrator votes once on every motion, in a shuffled order and
+    # in waves of `--concurrency` simultaneous clicks. Some change their
+    # mind and click another option straight away.
+    clicks = [(user_id, motion_id) for motion_id in motions for user_id in arbitrators]
+    rng.shuffle(clicks)
+    votes_cast = {}
+    update_id = 1
+    started = time.perf_counter()
+    for start in range(0, len(clicks), args.concurrency):
+        for user_id, motion_id in clicks[start:start + args.concurrency]:
+            vote_types = [rng.choices(['support', 'oppose', 'abstain'], weights=[6, 3, 1])[0]]
+            if rng.random() < args.revote_share:
+                vote_types.append(rng.choice([t for t in ('support', 'oppose', 'abstain') if t != vote_types[0]]))
+            for vote_type in vote_types:
+                update = callback_update(update_id, user_id, chat_id, motions[motion_id], motion_id, vote_type)
+                votes_cast[update['callback_query']['id']] = (motion_id, user_id)
+                source.push(update)
+                update_id += 1
+        if args.interval:
+            await asyncio.sleep(args.interval)
+
+    deadline = time.perf_counter() + args.timeout
+    while len(api.answered) < len(votes_cast) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    # Archive posts are sent from the outbox at the archive channel's rate
+    # limit; wait for it to empty, then for coalesced keyboard edits
+    while database.count_pending_outbox_db() and time.perf_counter() < deadline + args.timeout:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(args.settle)
+
+    if source is not api:
+        await source.close()
+    # The same order as run_polling: stop, post_stop, then shutdown
+    await application.updater.stop()
+    await application.stop()
+    await bot.post_stop(application)
+    await application.shutdown()
+    api.server.close()
+    bot.run_db = real_run_db
+
+    latencies = [(api.answered[cid] - t) * 1000 for cid, t in api.handed_out.items() if cid in api.answered]
+    closed = sum(1 for motion_id in motions if database.get_active_motion(motion_id) is None)
+    total_db = sum(db_calls.values())
+
+    print(f"delivery:           {args.delivery}")
+    print(f"updates:            {len(votes_cast)} ({args.arbitrators} arbitrators x {args.motions} motions"
+          f" + {len(votes_cast) - len(clicks)} changed votes)")
+    print(f"answered:           {len(latencies)} in {elapsed:.2f} s ({len(latencies) / elapsed:.1f}/s)")
+    print(f"ack latency ms:     p50={percentile(latencies, 50):.1f} p90={percentile(latencies, 90):.1f} "
+          f"p99={percentile(latencies, 99):.1f} max={max(latencies, default=0):.1f}")
+    print_histogram(latencies)
+    print(f"db round-trips:     {total_db} ({total_db / len(votes_cast):.2f} per update) {dict(db_calls)}")
+    print(f"api calls:          {dict(api.calls)}")
+    print(f"429s injected:      {dict(api.flood_waits)}")
+    print(f"motions closed:     {closed}/{len(motions)}")
+    print(f"handler errors:     {dict(errors) or 0}")
+    print(f"unanswered:         {len(votes_cast) - len(latencies)}")
+    problems = check_consistency(api, config['archive_channel_id'], votes_cast, args.arbitrators, threshold)
+    if source is not api:
+        print(f"webhook rejections: {dict(source.rejected) or 0}")
+        print(f"wrong secret:       {'refused' if secret_checked else 'ACCEPTED'}")
+        if not secret_checked:
+            problems.append("webhook accepted an update with a wrong secret token")
+    print(f"consistency:        {'ok' if not problems else f'{len(problems)} problems'}")
+    for problem in problems:
+        print(f"  - {problem}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--arbitrators', type=int, default=15)
+    parser.add_argument('--motions', type=int, default=5)
+    parser.add_argument('--threshold', type=int, default=0, help="majority threshold (default: simple majority)")
+    parser.add_argument('--concurrency', type=int, default=15, help="clicks released at the same moment")
+    parser.add_argument('--interval', type=float, default=0.05, help="seconds between waves of clicks")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="share of sends/edits answered with 429")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for all answers")
+    parser.add_argument('--settle', type=float, default=2, help="seconds to wait for trailing edits and archives")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--revote-share', type=float, default=0.0,
+                        help="share of clicks immediately followed by a changed vote")
+    parser.add_argument('--delivery', choices=['polling', 'webhook'], default='polling',
+                        help="how updates reach the bot")
+    args = parser.parse_args()
+
+    # Never touch the real database
+    database.DB_NAME = os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    database.init_db()
+    database.load_caches()
+    # Non-zero exit status when the consistency check fails
+    return 1 if asyncio.run(run(args)) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
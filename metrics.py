@@ -0,0 +1,233 @@
+"""
+In-process metrics exposed in the Prometheus text format on a local port.
+
+Metrics are plain module-level objects that any module can update; the
+exposition server is started from bot.py's post_init when `metrics_port` is
+set in config.json.
+"""
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from telegram.request import BaseRequest, HTTPXRequest
+from profiling import add_api_time
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Longer than a getUpdates long poll, so a proxy change never cuts one off
+PROXY_SWAP_GRACE = 60
+
+_registry = []
+_server = None
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        # Unlabelled metrics are exported from the start, not after the first update
+        self._values = {} if labels else {(): 0}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = [(k, list(v)) for k, v in self._values.items()]
+        for label_values, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [('le', f"{bound:g}")])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values, [('le', '+Inf')])
+            yield f"{self.name}_bucket{labels} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {state[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {state[-1]}"
+
+# Handlers
+handler_latency = Histogram('bot_handler_latency_seconds', "Time spent in each update handler.", ('handler',))
+handler_errors = Counter('bot_handler_errors_total', "Exceptions raised by update handlers.", ('handler', 'error'))
+# Database
+db_query_latency = Histogram('bot_db_query_seconds', "SQLite statement execution time by query.", ('query',))
+# Telegram Bot API
+api_latency = Histogram('bot_api_request_seconds', "Bot API request latency by method.", ('method',))
+api_flood_waits = Counter('bot_api_flood_waits_total', "Bot API requests answered with 429.", ('method',))
+# Outbox
+outbox_dead = Counter('bot_outbox_dead_total', "Outbox messages given up on, by error type.", ('error',))
+# Wikipedia monitor
+monitor_events = Counter('bot_monitor_events_total', "recentchange events received by the monitor.")
+monitor_matched = Counter('bot_monitor_events_matched_total', "recentchange events that matched a monitored page.")
+monitor_lag = Gauge('bot_monitor_lag_seconds', "Age of the latest decoded recentchange event from a followed wiki when it was processed.")
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def timed_handler(name, callback):
+    """Wraps an update handler callback to record its latency and errors."""
+    @functools.wraps(callback)
+    async def wrapped(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+    return wrapped
+
+class TimedRequest(BaseRequest):
+    """
+    Bot API request that records latency and 429 responses per method. The
+    HTTP work is done by an HTTPXRequest built from the keyword arguments,
+    which set_proxy can replace while the bot runs.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._request = HTTPXRequest(**kwargs)
+        self._retiring = set()
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        for task in self._retiring:
+            task.cancel()
+        await asyncio.gather(*self._retiring, return_exceptions=True)
+        await self._request.shutdown()
+
+    async def set_proxy(self, proxy):
+        """
+        Sends later requests through a new HTTPXRequest using `proxy`. The old
+        one is shut down after PROXY_SWAP_GRACE seconds so requests already in
+        flight on it, such as a long poll, can finish.
+        """
+        if self._kwargs.get('proxy') == proxy:
+            return
+        request = HTTPXRequest(**{**self._kwargs, 'proxy': proxy})
+        await request.initialize()
+        old, self._request = self._request, request
+        self._kwargs['proxy'] = proxy
+        task = asyncio.create_task(_retire(old))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await self._request.do_request(url, method, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            api_latency.observe(elapsed, api_method)
+            add_api_time(elapsed)
+        if code == 429:
+            api_flood_waits.inc(api_method)
+        return code, payload
+
+async def _retire(request):
+    try:
+        await asyncio.sleep(PROXY_SWAP_GRACE)
+    finally:
+        await request.shutdown()
+
+async def _serve(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Drain the headers; the request body, if any, is ignored
+        while (await reader.readline()).strip():
+            pass
+        path = request_line.split()[1] if len(request_line.split()) > 1 else b''
+        if path.split(b'?')[0] == b'/metrics':
+            body = render().encode()
+            status = b'200 OK'
+        else:
+            body = b'Not found\n'
+            status = b'404 Not Found'
+        writer.write(
+            b'HTTP/1.1 ' + status + b'\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host, port):
+    """Serves GET /metrics on host:port from the running event loop."""
+    global _server
+    _server = await asyncio.start_server(_serve, host, port)
+    print(f"Metrics available at http://{host}:{port}/metrics")
+
+async def stop_metrics_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
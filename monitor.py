@@ -1,79 +1,383 @@
 import json
-import threading
+import html
 import time
-import sseclient
-import requests
+import random
 import asyncio
+import functools
+import itertools
+from collections import namedtuple, deque
+import httpx
+from telegram.error import BadRequest, Forbidden
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 from config import load_config
+from database import get_setting_db, set_setting_db, run_db, get_page_subscribers, get_monitored_wikis
+from outbound import dispatcher, PRIORITY_MONITOR
+from metrics import monitor_events, monitor_matched, monitor_lag
 
 config = load_config()
-PAGE_TITLES = [
+# Pages followed by the default committee; other committees subscribe to
+# pages on any wiki with /watch_page (see page_subscriptions in database.py)
+DEFAULT_WIKI = "zhwiki"
+DEFAULT_PAGE_TITLES = frozenset([
     "Wikipedia:仲裁/請求",
     "Wikipedia:仲裁/請求/動議",
-    "Wikipedia:仲裁/請求/案件"
-    "Wikipedia:仲裁/請求/執行及復議"
-]
-STREAM_URL = "https://stream.wikimedia.org/v2/stream/recentchange"
+    "Wikipedia:仲裁/請求/案件",
+    "Wikipedia:仲裁/請求/執行及復議",
+])
+# Can be pointed at a local stand-in server for testing
+DEFAULT_STREAM_URL = "https://stream.wikimedia.org/v2/stream/recentchange"
+STREAM_URL = config.get('stream_url') or DEFAULT_STREAM_URL
+HEADERS = {'User-Agent': 'ArbitrationBot/1.0 (https://github.com/yourusername/bot; your@email.com)'}
+# Reconnect backoff: the first retry is almost immediate, later ones double
+# up to the cap, and each delay is jittered so flapping clients spread out.
+RECONNECT_BASE_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+# system_settings key holding the id of the last processed stream event
+LAST_EVENT_ID_KEY = 'monitor_last_event_id'
+# How often the resume position is saved while events are flowing
+SAVE_INTERVAL = 5
+# How many matched edits to remember for de-duplication
+SEEN_LIMIT = 1000
+# Edits to the same page within this many seconds are sent as one digest
+DIGEST_WINDOW = config.get('monitor_digest_window', 60)
+# At most this many edit summaries are listed in one digest
+DIGEST_MAX_SUMMARIES = 15
+# A digest whose send fails is retried this many times in all, with
+# doubling delays, unless the error is permanent (chat not found, bot removed)
+DIGEST_SEND_ATTEMPTS = 3
+DIGEST_RETRY_DELAY = 5
+# How long stop_monitor waits for the last digests to be sent
+DIGEST_STOP_TIMEOUT = 10
 
-def monitor_loop(bot_app, loop):
+def apply_config(old, new):
     """
-    Background loop to monitor Wikipedia edits.
+    Picks up reloaded monitor settings; a new stream_url is used from the
+    next reconnect.
     """
+    global STREAM_URL, DIGEST_WINDOW
+    if new.get('stream_url') != old.get('stream_url'):
+        STREAM_URL = new.get('stream_url') or DEFAULT_STREAM_URL
+    if new.get('monitor_digest_window') != old.get('monitor_digest_window'):
+        DIGEST_WINDOW = new['monitor_digest_window']
+
+config.on_reload(apply_config)
+
+SSEEvent = namedtuple('SSEEvent', ['event', 'data', 'id'])
+
+_monitor_task = None
+_seen_ids = set()
+_seen_order = deque()
+_digest_ids = itertools.count()
+# (wiki, title) -> (flush timer handle, list of edits waiting to be sent, digest id)
+_digests = {}
+# digest id -> [stream position to resume from to see its first edit again,
+# sends still outstanding] for every digest not yet sent to all its chats.
+# Ids only grow, so the first entry is the oldest unsent digest.
+_unsent = {}
+# Set once _unsent empties while stop_monitor waits for it
+_all_sent = None
+# Stream position just before the event being processed
+_replay_from = b''
+# Stream position reached when the monitor task stopped
+_stopped_at = None
+# Raw-payload prefilter: b'"<wiki>"' for every wiki with a followed page.
+# Events for other wikis never contain one, so they are dropped before being
+# decoded. Rebuilt whenever the subscription cache swaps in a new wiki set.
+_wiki_markers = (None, ())
+
+async def iter_sse(chunks):
+    """
+    Incrementally parses a text/event-stream from an async iterator of byte
+    chunks, yielding one SSEEvent per dispatched event. All fields are left
+    as raw bytes so callers only pay for decoding the events they keep.
+    """
+    buffer = b''
+    event_type, data, event_id = b'', None, None
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end == -1:
+                break
+            line = buffer[start:end]
+            start = end + 1
+            if line.endswith(b'\r'):
+                line = line[:-1]
+
+            if not line:
+                # Blank line: dispatch the event collected so far
+                if data is not None:
+                    yield SSEEvent(event_type or b'message', data, event_id)
+                event_type, data = b'', None
+                continue
+            if line.startswith(b':'):
+                continue
+
+            field, _, value = line.partition(b':')
+            if value.startswith(b' '):
+                value = value[1:]
+            if field == b'data':
+                data = value if data is None else data + b'\n' + value
+            elif field == b'event':
+                event_type = value
+            elif field == b'id':
+                event_id = value
+        buffer = buffer[start:]
+
+def reconnect_delay(attempt):
+    """Jittered exponential backoff for the given (0-based) retry attempt."""
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+async def monitor_loop():
+    """
+    Background task that follows the Wikimedia recentchange stream. The id of
+    the last processed event is persisted so that a reconnect, or a restart,
+    resumes where the previous connection stopped instead of at the live head.
+    The saved id never passes an edit whose digest has not been sent, so a
+    crash replays it instead of losing it.
+    """
+    global _replay_from, _stopped_at
     print("Starting Wikipedia monitor...")
-    while True:
-        try:
-            # Use requests with stream=True for better stability
-            headers = {'User-Agent': 'ArbitrationBot/1.0 (https://github.com/yourusername/bot; your@email.com)'}
-            response = requests.get(STREAM_URL, stream=True, timeout=30, headers=headers)
-            client = sseclient.SSEClient(response)
-            for event in client.events():
-                if event.event == 'message':
-                    try:
-                        data = json.loads(event.data)
-                        process_event(data, bot_app, loop)
-                    except json.JSONDecodeError:
-                        pass
-        except Exception as e:
-            print(f"Monitor connection lost: {e}. Reconnecting in 30s...")
-            time.sleep(30)
-
-def process_event(data, bot_app, loop):
-    if data.get('wiki') != 'zhwiki':
-        return
+    # Kept as raw bytes from the stream and only decoded when saved or sent
+    last_event_id = (get_setting_db(LAST_EVENT_ID_KEY) or '').encode()
+    saved_event_id = last_event_id
+    saved_at = time.monotonic()
+    attempt = 0
+    timeout = httpx.Timeout(30, read=60)
+    try:
+        async with httpx.AsyncClient(headers=HEADERS, timeout=timeout) as client:
+            while True:
+                headers = {'Last-Event-ID': last_event_id.decode()} if last_event_id else {}
+                try:
+                    async with client.stream('GET', STREAM_URL, headers=headers) as response:
+                        response.raise_for_status()
+                        async for event in iter_sse(response.aiter_bytes()):
+                            attempt = 0
+                            _replay_from = last_event_id
+                            if event.id:
+                                last_event_id = event.id
+                            if event.event == b'message':
+                                handle_payload(event.data)
+                            if time.monotonic() - saved_at >= SAVE_INTERVAL:
+                                resume_id = resume_event_id(last_event_id)
+                                if resume_id != saved_event_id:
+                                    await run_db(set_setting_db, LAST_EVENT_ID_KEY, resume_id.decode())
+                                    saved_event_id = resume_id
+                                saved_at = time.monotonic()
+                except Exception as e:
+                    reason = e
+                else:
+                    reason = "stream closed by server"
+                delay = reconnect_delay(attempt)
+                attempt += 1
+                print(f"Monitor connection lost: {reason}. Reconnecting in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+    finally:
+        _stopped_at = last_event_id
+        resume_id = resume_event_id(last_event_id)
+        if resume_id != saved_event_id:
+            await run_db(set_setting_db, LAST_EVENT_ID_KEY, resume_id.decode())
+
+def resume_event_id(last_event_id):
+    """
+    Returns the stream position that is safe to save: `last_event_id`, or
+    the position before the oldest edit whose digest has not been sent.
+    """
+    for replay_from, _ in _unsent.values():
+        return replay_from
+    return last_event_id
+
+def _first_time_seen(event_key):
+    if event_key in _seen_ids:
+        return False
+    _seen_ids.add(event_key)
+    _seen_order.append(event_key)
+    if len(_seen_order) > SEEN_LIMIT:
+        _seen_ids.discard(_seen_order.popleft())
+    return True
+
+def wiki_markers():
+    global _wiki_markers
+    wikis = get_monitored_wikis()
+    if _wiki_markers[0] is not wikis:
+        _wiki_markers = (wikis, tuple(f'"{wiki}"'.encode() for wiki in wikis))
+    return _wiki_markers[1]
+
+def handle_payload(raw):
+    """
+    Filters and processes one raw recentchange payload. Returns True if it
+    matched a monitored page.
+    """
+    monitor_events.inc()
+    for marker in wiki_markers():
+        if marker in raw:
+            break
+    else:
+        return False
+    try:
+        data = _loads(raw)
+    except ValueError:
+        return False
+    timestamp = data.get('timestamp')
+    if isinstance(timestamp, (int, float)):
+        monitor_lag.set(time.time() - timestamp)
+    matched = process_event(data)
+    if matched:
+        monitor_matched.inc()
+    return matched
+
+def process_event(data):
+    """
+    Queues a matching edit for its page's digest. Returns True if the event
+    matched a page some committee follows.
+    """
     if data.get('type') != 'edit':
-        return
-    
+        return False
+
+    wiki = data.get('wiki')
     title = data.get('title')
-    if title not in PAGE_TITLES:
-        return
-        
+    if not get_page_subscribers(wiki, title):
+        return False
+
+    # Events replayed after a resume may already have been alerted on
+    event_key = data.get('meta', {}).get('id') or (title, data.get('revision', {}).get('new'))
+    if not _first_time_seen(event_key):
+        return False
+
     # Found a match
-    user = data.get('user')
-    timestamp = data.get('timestamp') # Unix timestamp
-    comment = data.get('comment', 'No summary')
-    diff_url = data.get('server_url', '') + '/w/index.php?diff=' + str(data.get('revision', {}).get('new'))
-    
-    msg = (
-        f"🔔 <b>新仲裁請求 / 編輯</b>\n\n"
-        f"<b>頁面：</b> <a href=\"{data.get('server_url')}/wiki/{title}\">{title}</a>\n"
-        f"<b>用戶：</b> {user}\n"
-        f"<b>摘要：</b> {comment}\n"
-        f"<a href=\"{diff_url}\">查看差異</a>"
+    revision = data.get('revision', {})
+    edit = {
+        'user': data.get('user'),
+        'comment': data.get('comment') or 'No summary',
+        'server_url': data.get('server_url', ''),
+        'old': revision.get('old'),
+        'new': revision.get('new'),
+    }
+    page = (wiki, title)
+    pending = _digests.get(page)
+    if pending is None:
+        handle = asyncio.get_running_loop().call_later(DIGEST_WINDOW, flush_digest, page)
+        digest_id = next(_digest_ids)
+        _unsent[digest_id] = [_replay_from, 0]
+        _digests[page] = (handle, [edit], digest_id)
+    else:
+        pending[1].append(edit)
+    return True
+
+def flush_digest(page):
+    """Sends the edits gathered for a (wiki, title) page as one message to each committee following it."""
+    pending = _digests.pop(page, None)
+    if pending is None:
+        return
+    handle, edits, digest_id = pending
+    handle.cancel()
+    text = format_digest(page[1], edits)
+    chats = get_page_subscribers(*page)
+    _unsent[digest_id][1] = len(chats)
+    if not chats:
+        _digest_done(digest_id)
+    for chat_id in chats:
+        _send_digest(digest_id, chat_id, text)
+
+def _send_digest(digest_id, chat_id, text, attempt=0):
+    sent = dispatcher.submit(chat_id, text, PRIORITY_MONITOR, parse_mode='HTML')
+    sent.add_done_callback(functools.partial(_digest_sent, digest_id, chat_id, text, attempt))
+
+def _digest_sent(digest_id, chat_id, text, attempt, future):
+    if future.cancelled():
+        # Dropped by a stopping dispatcher: keep the position before it
+        return
+    error = future.exception()
+    if error is not None:
+        if not isinstance(error, (BadRequest, Forbidden)) and attempt + 1 < DIGEST_SEND_ATTEMPTS:
+            delay = DIGEST_RETRY_DELAY * 2 ** attempt
+            print(f"Failed to send monitor alert to {chat_id}, retrying in {delay}s: {error}")
+            asyncio.get_running_loop().call_later(delay, _send_digest, digest_id, chat_id, text, attempt + 1)
+            return
+        print(f"Giving up on monitor alert to {chat_id}: {error}")
+    entry = _unsent[digest_id]
+    entry[1] -= 1
+    if entry[1] == 0:
+        _digest_done(digest_id)
+
+def _digest_done(digest_id):
+    del _unsent[digest_id]
+    if not _unsent and _all_sent is not None:
+        _all_sent.set()
+
+def flush_all_digests():
+    for page in list(_digests):
+        flush_digest(page)
+
+def format_digest(title, edits):
+    server_url = edits[-1]['server_url']
+    page_link = f"<a href=\"{server_url}/wiki/{html.escape(title)}\">{html.escape(title)}</a>"
+
+    if len(edits) == 1:
+        edit = edits[0]
+        diff_url = f"{server_url}/w/index.php?diff={edit['new']}"
+        return (
+            f"🔔 <b>新仲裁請求 / 編輯</b>\n\n"
+            f"<b>頁面：</b> {page_link}\n"
+            f"<b>用戶：</b> {html.escape(str(edit['user']))}\n"
+            f"<b>摘要：</b> {html.escape(edit['comment'])}\n"
+            f"<a href=\"{diff_url}\">查看差異</a>"
+        )
+
+    # One diff spanning the whole burst: from before the first edit to after the last
+    diff_url = f"{server_url}/w/index.php?diff={edits[-1]['new']}"
+    if edits[0]['old']:
+        diff_url += f"&oldid={edits[0]['old']}"
+    contributors = list(dict.fromkeys(str(edit['user']) for edit in edits))
+    summaries = "".join(
+        f"• {html.escape(str(edit['user']))}：{html.escape(edit['comment'])}\n"
+        for edit in edits[:DIGEST_MAX_SUMMARIES]
     )
-    
-    # Send message safely from thread
-    asyncio.run_coroutine_threadsafe(
-        bot_app.bot.send_message(
-            chat_id=config['arbcom_group_id'],
-            text=msg,
-            parse_mode='HTML'
-        ),
-        loop
+    if len(edits) > DIGEST_MAX_SUMMARIES:
+        summaries += f"…另有 {len(edits) - DIGEST_MAX_SUMMARIES} 次編輯\n"
+    return (
+        f"🔔 <b>新仲裁請求 / 編輯（{len(edits)} 次）</b>\n\n"
+        f"<b>頁面：</b> {page_link}\n"
+        f"<b>用戶：</b> {html.escape(', '.join(contributors))}\n"
+        f"<b>摘要：</b>\n{summaries}"
+        f"<a href=\"{diff_url}\">查看差異</a>"
     )
 
-def start_monitor(application, loop):
+def start_monitor():
     """
-    Starts the monitor in a separate thread.
+    Starts the monitor as a task on the running event loop.
     """
-    thread = threading.Thread(target=monitor_loop, args=(application, loop), daemon=True)
-    thread.start()
+    global _monitor_task
+    _monitor_task = asyncio.create_task(monitor_loop())
+
+async def stop_monitor():
+    """
+    Cancels the monitor task, sends the digests that were still gathering
+    edits and waits up to DIGEST_STOP_TIMEOUT seconds for them to go out,
+    then saves the position past the digests that were sent. Must run while
+    the dispatcher is still sending.
+    """
+    global _monitor_task, _all_sent
+    if _monitor_task is not None:
+        _monitor_task.cancel()
+        try:
+            await _monitor_task
+        except asyncio.CancelledError:
+            pass
+        _monitor_task = None
+    flush_all_digests()
+    if _unsent:
+        _all_sent = asyncio.Event()
+        try:
+            await asyncio.wait_for(_all_sent.wait(), DIGEST_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"{len(_unsent)} monitor digests were not sent; they are replayed on the next start.")
+        _all_sent = None
+    if _stopped_at is not None:
+        await run_db(set_setting_db, LAST_EVENT_ID_KEY, resume_event_id(_stopped_at).decode())
@@ -0,0 +1,76 @@
+import threading
+
+VOTE_TYPES = ("support", "oppose", "abstain")
+
+class MotionState:
+    """
+    Live view of one active motion: its database row, the running count per
+    vote option and who voted what.
+    """
+    __slots__ = ('motion', 'tallies', 'voters')
+
+    def __init__(self, motion, tallies=None, voters=None):
+        self.motion = motion
+        self.tallies = tallies if tallies is not None else dict.fromkeys(VOTE_TYPES, 0)
+        # user_id -> (username, vote_type), in the order the votes were cast
+        self.voters = voters if voters is not None else {}
+
+class MotionStore:
+    """
+    In-memory state of every active motion. It is filled from the database at
+    startup and then kept current by the write functions in database.py, so a
+    vote is a counter update instead of a reload of every vote row.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._motions = {}
+        self.loaded = False
+
+    def hydrate(self, motions, votes):
+        """Replaces the store contents with the given motion and vote rows."""
+        states = {row['id']: MotionState(dict(row)) for row in motions}
+        for vote in votes:
+            state = states.get(vote['motion_id'])
+            if state is not None:
+                _apply(state, vote['user_id'], vote['username'], vote['vote_type'])
+        with self._lock:
+            self._motions = states
+            self.loaded = True
+
+    def add(self, motion):
+        with self._lock:
+            self._motions[motion['id']] = MotionState(dict(motion))
+
+    def remove(self, motion_id):
+        """Drops a motion from the store and returns its final state, if any."""
+        with self._lock:
+            return self._motions.pop(motion_id, None)
+
+    def apply_vote(self, motion_id, user_id, username, vote_type):
+        """
+        Records a (possibly changed) vote and returns a copy of the updated
+        tallies, or None if the motion is not active.
+        """
+        with self._lock:
+            state = self._motions.get(motion_id)
+            if state is None:
+                return None
+            _apply(state, user_id, username, vote_type)
+            return dict(state.tallies)
+
+    def get_motion(self, motion_id):
+        state = self._motions.get(motion_id)
+        return state.motion if state is not None else None
+
+    def get_tallies(self, motion_id):
+        with self._lock:
+            state = self._motions.get(motion_id)
+            return dict(state.tallies) if state is not None else None
+
+def _apply(state, user_id, username, vote_type):
+    previous = state.voters.pop(user_id, None)
+    if previous is not None:
+        state.tallies[previous[1]] -= 1
+    state.voters[user_id] = (username, vote_type)
+    state.tallies[vote_type] = state.tallies.get(vote_type, 0) + 1
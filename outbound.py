@@ -0,0 +1,148 @@
+import asyncio
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+from utils import retry_after_seconds
+
+# Lower values are sent first
+PRIORITY_ARCHIVE = 0
+PRIORITY_RESULT = 1
+PRIORITY_NOTICE = 2
+PRIORITY_MONITOR = 3
+
+# Telegram allows roughly 30 messages per second in total and 20 per minute
+# into any one group or channel.
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+CHAT_RATE = 20 / 60
+CHAT_BURST = 5
+# How long stop() waits for queued messages to be sent before dropping them
+STOP_DRAIN_TIMEOUT = 10
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class MessageDispatcher:
+    """
+    Single funnel for messages the bot sends on its own initiative (archive
+    posts, close results, notices and monitor pings). Messages are sent in
+    priority order, throttled by a global and a per-chat token bucket, and
+    RetryAfter responses pause the affected chat and requeue the message
+    instead of dropping it.
+    """
+
+    def __init__(self):
+        self.bot = None
+        self._queue = None
+        self._worker = None
+        self._sends = set()
+        self._seq = itertools.count()
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chats = {}
+
+    def start(self, bot):
+        self.bot = bot
+        self._queue = asyncio.PriorityQueue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=STOP_DRAIN_TIMEOUT):
+        """
+        Waits up to `timeout` seconds for the queued messages to be sent, then
+        stops the worker. Whatever is still queued or sending after that is
+        dropped.
+        """
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Messages still unsent on shutdown are dropped ({self._queue.qsize()} queued)")
+            self._worker.cancel()
+            for task in self._sends:
+                task.cancel()
+            await asyncio.gather(self._worker, *self._sends, return_exceptions=True)
+            self._worker = None
+
+    def submit(self, chat_id, text, priority=PRIORITY_NOTICE, **kwargs):
+        """Queues a message and returns a future resolving to the sent Message."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._seq), chat_id, text, kwargs, future))
+        return future
+
+    async def send_message(self, chat_id, text, priority=PRIORITY_NOTICE, **kwargs):
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST)
+        return bucket
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            chat_id = item[2]
+            if item[5].cancelled():
+                self._queue.task_done()
+                continue
+            wait = self._bucket(chat_id).delay()
+            if wait > 0:
+                # Park it so other chats are not held up behind this one
+                loop.call_later(wait, self._requeue, item)
+                continue
+            await asyncio.sleep(self._global.delay())
+            self._global.take()
+            self._bucket(chat_id).take()
+            task = asyncio.create_task(self._send(item))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    def _requeue(self, item):
+        # Put back before marking the old entry done, so stop() keeps waiting
+        self._queue.put_nowait(item)
+        self._queue.task_done()
+
+    async def _send(self, item):
+        priority, seq, chat_id, text, kwargs, future = item
+        try:
+            message = await self.bot.send_message(chat_id, text, **kwargs)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            logging.warning(f"Flood wait of {delay}s for chat {chat_id}; message requeued")
+            self._bucket(chat_id).block(delay)
+            self._requeue(item)
+        except Exception as e:
+            self._queue.task_done()
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self._queue.task_done()
+            if not future.done():
+                future.set_result(message)
+
+dispatcher = MessageDispatcher()
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from telegram.error import BadRequest, Forbidden
+from database import run_db, get_due_outbox_db, mark_outbox_db
+from metrics import outbox_dead
+from outbound import dispatcher
+
+# Messages taken from the outbox per round
+OUTBOX_BATCH = 20
+# How often the outbox is checked when nothing wakes the drainer, which is
+# what picks up messages waiting for a retry
+POLL_INTERVAL = 30
+# Retry backoff after a failed send: doubles per attempt up to the cap
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 600
+# A message still failing after this many attempts is given up on (about
+# two and a half hours of retries with the backoff above)
+OUTBOX_MAX_ATTEMPTS = 20
+# Errors that sending again cannot fix, e.g. chat not found or the bot
+# removed from the chat; such messages are given up on straight away
+PERMANENT_ERRORS = (BadRequest, Forbidden)
+
+class OutboxDrainer:
+    """
+    Sends the messages queued in the outbox table. Handlers queue a message
+    in the same transaction as the change it announces and call wake(); the
+    drainer hands batches to the dispatcher (which deals with rate limits and
+    flood waits) and records which were sent. Failed sends stay in the
+    outbox and are retried with backoff, including after a restart, unless
+    the error is permanent or OUTBOX_MAX_ATTEMPTS is reached; those are
+    marked dead, logged and counted in bot_outbox_dead_total.
+
+    Delivery is at least once: a message sent just before a crash, but not
+    yet marked as sent, is sent again.
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        """Asks the drainer to check the outbox now, e.g. after queueing a message."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                drained = await self.drain_once()
+            except Exception:
+                logging.exception("Draining the outbox failed")
+                drained = 0
+            if drained == OUTBOX_BATCH:
+                # There may be more due right away
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self):
+        """Sends one batch of due messages and returns how many were attempted."""
+        rows = await run_db(get_due_outbox_db, time.time(), OUTBOX_BATCH)
+        if not rows:
+            return 0
+        results = await asyncio.gather(
+            *(self.dispatcher.submit(row['chat_id'], row['text'], row['priority'], parse_mode=row['parse_mode'])
+              for row in rows),
+            return_exceptions=True
+        )
+        sent, failed, dead = [], [], []
+        now = time.time()
+        for row, result in zip(rows, results):
+            if not isinstance(result, Exception):
+                sent.append((result.message_id, row['id']))
+            elif isinstance(result, PERMANENT_ERRORS) or row['attempts'] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                logging.error(f"Giving up on {row['dedupe_key']} to {row['chat_id']} after "
+                              f"{row['attempts'] + 1} attempts: {result}")
+                outbox_dead.inc(type(result).__name__)
+                dead.append((str(result), row['id']))
+            else:
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** row['attempts'])
+                logging.warning(f"Failed to send {row['dedupe_key']} (attempt {row['attempts'] + 1}), retrying in {delay}s: {result}")
+                failed.append((str(result), now + delay, row['id']))
+        await run_db(mark_outbox_db, sent, failed, dead)
+        return len(rows)
+
+outbox_drainer = OutboxDrainer(dispatcher)
@@ -0,0 +1,185 @@
+"""
+Opt-in per-update profiling, enabled with "profiling": {"enabled": true} in
+config.json. Each handled update records its wall time, the CPU time the
+event loop spent on it, and how much of the wall time went to the database
+and to Bot API requests. Slow updates are logged with that breakdown and
+/stats reports the totals.
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import time
+from collections import deque
+
+ENABLED = False
+# Updates taking longer than this are logged
+SLOW_UPDATE_MS = 1000
+# Window for the "recent" update rate in /stats
+THROUGHPUT_WINDOW = 60
+# Functions listed in an on-demand profile
+PROFILE_LINES = 30
+
+class UpdateProfile:
+    __slots__ = ('path', 'db', 'api', 'cpu')
+
+    def __init__(self, path):
+        self.path = path
+        self.db = 0.0
+        self.api = 0.0
+        self.cpu = 0.0
+
+_current = contextvars.ContextVar('update_profile', default=None)
+# path -> [updates, wall, cpu, db, api, max wall], all times in seconds
+_paths = {}
+_recent = deque()
+_started_at = time.monotonic()
+# When profiling was last turned on; update rates are averaged from here
+_enabled_at = _started_at
+_updates = 0
+_sampling = False
+
+def configure(settings):
+    global ENABLED, SLOW_UPDATE_MS, _enabled_at
+    enabled = bool(settings.get('enabled', False))
+    if enabled and not ENABLED:
+        _enabled_at = time.monotonic()
+    ENABLED = enabled
+    SLOW_UPDATE_MS = settings.get('slow_update_ms', SLOW_UPDATE_MS)
+
+def add_db_time(seconds):
+    profile = _current.get()
+    if profile is not None:
+        profile.db += seconds
+
+def add_api_time(seconds):
+    profile = _current.get()
+    if profile is not None:
+        profile.api += seconds
+
+def mark_denied():
+    """Files the current update under a separate path when authorization fails."""
+    profile = _current.get()
+    if profile is not None:
+        profile.path += ' (denied)'
+
+class _CPUTimed:
+    """
+    Awaits a coroutine while adding the thread CPU time of each of its steps
+    to a profile, so time spent running other tasks in between is not
+    counted.
+    """
+    __slots__ = ('coro', 'profile')
+
+    def __init__(self, coro, profile):
+        self.coro = coro
+        self.profile = profile
+
+    def __await__(self):
+        coro, profile = self.coro, self.profile
+        send, value = coro.send, None
+        while True:
+            started = time.thread_time()
+            try:
+                yielded = send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                profile.cpu += time.thread_time() - started
+            try:
+                value = yield yielded
+                send = coro.send
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                value = e
+                send = coro.throw
+
+def profiled(name, callback):
+    """
+    Wraps an update handler callback to profile the updates it handles while
+    profiling is enabled, so turning it on or off by a reload takes effect
+    straight away.
+    """
+    @functools.wraps(callback)
+    async def wrapped(update, context):
+        if not ENABLED:
+            return await callback(update, context)
+        profile = UpdateProfile(name)
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            return await _CPUTimed(callback(update, context), profile)
+        finally:
+            _current.reset(token)
+            _finish(profile, time.perf_counter() - started)
+    return wrapped
+
+def _finish(profile, wall):
+    global _updates
+    stats = _paths.get(profile.path)
+    if stats is None:
+        stats = _paths[profile.path] = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    stats[0] += 1
+    stats[1] += wall
+    stats[2] += profile.cpu
+    stats[3] += profile.db
+    stats[4] += profile.api
+    stats[5] = max(stats[5], wall)
+
+    _updates += 1
+    now = time.monotonic()
+    _recent.append(now)
+    while _recent[0] < now - THROUGHPUT_WINDOW:
+        _recent.popleft()
+
+    if wall * 1000 >= SLOW_UPDATE_MS:
+        other = max(0.0, wall - profile.db - profile.api)
+        logging.warning(
+            f"Slow update: {profile.path} took {wall * 1000:.0f} ms "
+            f"(db {profile.db * 1000:.0f} ms, api {profile.api * 1000:.0f} ms, "
+            f"other {other * 1000:.0f} ms, cpu {profile.cpu * 1000:.0f} ms)"
+        )
+
+def summary(top=5):
+    """
+    Returns (uptime, updates, updates per minute since profiling was turned
+    on, recent updates per minute, slowest paths), the paths as (path,
+    updates, mean wall, mean cpu, mean db, mean api, max wall) sorted by mean
+    wall time.
+    """
+    now = time.monotonic()
+    while _recent and _recent[0] < now - THROUGHPUT_WINDOW:
+        _recent.popleft()
+    paths = [
+        (path, n, wall / n, cpu / n, db / n, api / n, max_wall)
+        for path, (n, wall, cpu, db, api, max_wall) in _paths.items()
+    ]
+    paths.sort(key=lambda p: p[2], reverse=True)
+    average = _updates * 60 / max(now - _enabled_at, 1)
+    return now - _started_at, _updates, average, len(_recent) * 60 / THROUGHPUT_WINDOW, paths[:top]
+
+async def sample_profile(seconds):
+    """
+    Profiles everything the event loop runs for the given number of seconds
+    and returns the busiest functions as text, or None if a profile is
+    already being taken.
+    """
+    global _sampling
+    if _sampling:
+        return None
+    _sampling = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+        _sampling = False
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return stream.getvalue()
@@ -0,0 +1,261 @@
+"""
+Replays a recorded (or synthetic) recentchange stream through the Wikipedia
+monitor and reports throughput, CPU cost, match latency and memory growth.
+
+Run it from the bot directory, since monitor.py loads config.json on import:
+
+    python replay_monitor.py --synthetic 200000
+    python replay_monitor.py --capture recentchange.jsonl --rate 500
+    python replay_monitor.py --capture recentchange.sse --mode stream
+
+Captures may be JSONL (one event per line) or raw text/event-stream as saved
+with e.g. `curl -N https://stream.wikimedia.org/v2/stream/recentchange`.
+
+In "process" mode payloads are fed straight into monitor.handle_payload; in
+"stream" mode they are served over a local SSE server and consumed by the
+real monitor_loop. Telegram is replaced by a fake bot that only records the
+time of each send.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import database
+import monitor
+import outbound
+
+SYNTHETIC_WIKIS = ["enwiki", "wikidatawiki", "commonswiki", "dewiki", "frwiki", "jawiki", "zhwiki"]
+
+class FakeBot:
+    """Stands in for bot_app.bot and records when each monitor alert is sent."""
+
+    def __init__(self, pending):
+        self.pending = pending
+        self.latencies = []
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        now = time.perf_counter()
+        self.sent += 1
+        for title, fed_at in list(self.pending.items()):
+            if f">{title}</a>" in text:
+                self.latencies.extend(now - t for t in fed_at)
+                del self.pending[title]
+        return None
+
+def read_capture(path):
+    """Yields raw event payloads (bytes) from a JSONL or SSE capture."""
+    with open(path, 'rb') as f:
+        first = f.readline()
+        f.seek(0)
+        if first.startswith((b'event:', b'data:', b'id:', b':')):
+            for line in f:
+                if line.startswith(b'data:'):
+                    yield line[5:].strip()
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+def synthetic_events(count, match_ratio, seed=1):
+    """Yields recentchange-shaped payloads, a fraction of them matching."""
+    rng = random.Random(seed)
+    titles = sorted(monitor.DEFAULT_PAGE_TITLES)
+    for i in range(count):
+        if rng.random() < match_ratio:
+            wiki, title = "zhwiki", rng.choice(titles)
+        else:
+            wiki = rng.choice(SYNTHETIC_WIKIS)
+            title = f"Page {rng.randrange(1_000_000)}"
+        event = {
+            "$schema": "/mediawiki/recentchange/1.0.0",
+            "meta": {"id": f"synthetic-{i}", "domain": f"{wiki}.example", "stream": "mediawiki.recentchange"},
+            "id": i,
+            "type": rng.choice(["edit", "edit", "edit", "log", "categorize"]) if wiki != "zhwiki" else "edit",
+            "namespace": 4,
+            "title": title,
+            "comment": f"synthetic edit {i}",
+            "timestamp": int(time.time()),
+            "user": f"User{rng.randrange(500)}",
+            "bot": False,
+            "server_url": "https://zh.wikipedia.org",
+            "wiki": wiki,
+            "revision": {"old": 1000 + i, "new": 1001 + i},
+        }
+        yield json.dumps(event, ensure_ascii=False, separators=(',', ':')).encode()
+
+def match_of(raw):
+    """Returns the decoded event if the monitor would match it, else None."""
+    data = json.loads(raw)
+    if data.get('type') == 'edit' and database.get_page_subscribers(data.get('wiki'), data.get('title')):
+        return data
+    return None
+
+async def paced(payloads, rate):
+    """Yields payloads no faster than `rate` per second (0 = unthrottled)."""
+    start = time.perf_counter()
+    for i, raw in enumerate(payloads):
+        if rate:
+            ahead = start + i / rate - time.perf_counter()
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+        elif i % 1000 == 0:
+            await asyncio.sleep(0)
+        yield raw
+
+async def run_process_mode(payloads, rate, pending):
+    count = 0
+    async for raw in paced(payloads, rate):
+        fed_at = time.perf_counter()
+        if monitor.handle_payload(raw):
+            pending.setdefault(match_of(raw)['title'], []).append(fed_at)
+        count += 1
+    return count
+
+def serve_sse(payloads, rate, fed_times, ready, port_holder):
+    """Runs a one-shot SSE server on a separate thread and loop."""
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n')
+        i = 0
+        async for raw in paced(payloads, rate):
+            data = match_of(raw)
+            if data is not None:
+                fed_times[data['meta']['id']] = time.perf_counter()
+            writer.write(b'event: message\nid: [{"offset":%d}]\ndata: %s\n\n' % (i, raw))
+            if i % 100 == 0:
+                await writer.drain()
+            i += 1
+        await writer.drain()
+        writer.close()
+        port_holder['done'] = i
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port_holder['port'] = server.sockets[0].getsockname()[1]
+        ready.set()
+        async with server:
+            while 'done' not in port_holder:
+                await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+
+async def run_stream_mode(payloads, rate, pending):
+    fed_times = {}
+    ready = threading.Event()
+    info = {}
+    server = threading.Thread(target=serve_sse, args=(payloads, rate, fed_times, ready, info), daemon=True)
+    server.start()
+    ready.wait()
+    monitor.STREAM_URL = f"http://127.0.0.1:{info['port']}/"
+
+    original = monitor.process_event
+
+    def counting(data):
+        result = original(data)
+        if result:
+            fed_at = fed_times.pop(data['meta']['id'], time.perf_counter())
+            pending.setdefault(data['title'], []).append(fed_at)
+        return result
+
+    monitor.process_event = counting
+    monitor.start_monitor()
+    while 'done' not in info:
+        await asyncio.sleep(0.05)
+    # Let the client drain what the server already wrote
+    await asyncio.sleep(0.5)
+    await monitor.stop_monitor()
+    monitor.process_event = original
+    return info['done']
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def benchmark(args):
+    if args.capture:
+        payloads = list(read_capture(args.capture))
+    else:
+        payloads = list(synthetic_events(args.synthetic, args.match_ratio))
+
+    monitor.DIGEST_WINDOW = args.digest_window
+    if args.unthrottled:
+        outbound.CHAT_RATE = outbound.CHAT_BURST = 1_000_000
+        outbound.dispatcher._global = outbound.TokenBucket(1_000_000, 1_000_000)
+
+    pending = {}
+    bot = FakeBot(pending)
+    outbound.dispatcher.start(bot)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    mem_before = tracemalloc.get_traced_memory()[0]
+    cpu_before = time.thread_time()
+    wall_before = time.perf_counter()
+
+    if args.mode == 'stream':
+        count = await run_stream_mode(payloads, args.rate, pending)
+    else:
+        count = await run_process_mode(payloads, args.rate, pending)
+
+    wall = time.perf_counter() - wall_before
+    cpu = time.thread_time() - cpu_before
+    monitor.flush_all_digests()
+    await asyncio.sleep(args.digest_window + 0.2)
+    await outbound.dispatcher.stop()
+    mem_after, mem_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies_ms = [x * 1000 for x in bot.latencies]
+    print(f"mode:               {args.mode}")
+    print(f"events:             {count}")
+    print(f"wall time:          {wall:.3f} s")
+    print(f"throughput:         {count / wall if wall else 0:,.0f} events/s")
+    print(f"cpu per event:      {cpu / count * 1e6 if count else 0:.2f} us")
+    print(f"alerts sent:        {bot.sent}")
+    print(f"matched edits:      {len(latencies_ms)}")
+    print(f"match latency ms:   p50={percentile(latencies_ms, 50):.2f} "
+          f"p95={percentile(latencies_ms, 95):.2f} p99={percentile(latencies_ms, 99):.2f} "
+          f"max={max(latencies_ms, default=0):.2f}")
+    if args.trace_memory:
+        print(f"memory growth:      {(mem_after - mem_before) / 1024:.1f} KiB (peak {mem_peak / 1024:.1f} KiB)")
+    print(f"max rss:            {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--capture', help="recorded recentchange JSONL or SSE file")
+    source.add_argument('--synthetic', type=int, default=100_000, help="number of synthetic events (default 100000)")
+    parser.add_argument('--match-ratio', type=float, default=0.001, help="fraction of synthetic events that match")
+    parser.add_argument('--rate', type=float, default=0, help="events per second to replay at (0 = as fast as possible)")
+    parser.add_argument('--mode', choices=['process', 'stream'], default='process')
+    parser.add_argument('--digest-window', type=float, default=0, help="monitor digest window in seconds (default 0)")
+    parser.add_argument('--unthrottled', action='store_true', help="lift the dispatcher's rate limits")
+    parser.add_argument('--no-trace-memory', dest='trace_memory', action='store_false',
+                        help="skip tracemalloc, which otherwise inflates the CPU figures")
+    args = parser.parse_args()
+
+    # Keep the resume position and settings away from the real database
+    database.DB_NAME = os.path.join(tempfile.mkdtemp(), "replay.db")
+    database.init_db()
+    # One committee following the default pages, as on a fresh install
+    database.seed_default_committee_db(
+        monitor.config['arbcom_group_id'], "replay", monitor.config['archive_channel_id'],
+        monitor.DEFAULT_WIKI, monitor.DEFAULT_PAGE_TITLES
+    )
+    asyncio.run(benchmark(args))
+    database.shutdown_db_worker()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,27 @@
+import json
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Modules read config.json from the working directory at import time, so the
+# tests run from a scratch directory holding a minimal one
+_workdir = tempfile.mkdtemp(prefix="arbcom-bot-tests-")
+with open(os.path.join(_workdir, "config.json"), "w") as f:
+    json.dump({"bot_token": "123:ABC", "owner_id": 1, "arbcom_group_id": -100, "archive_channel_id": -200}, f)
+os.chdir(_workdir)
+
+import database
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database in a temporary file, with the caches loaded from it."""
+    database.close_db_connection()
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "test.db"))
+    database.init_db()
+    database.load_caches()
+    yield database
+    database.close_db_connection()
@@ -0,0 +1,13 @@
+import functools
+import bot
+
+def test_motion_of_a_chat_without_committee_closes_to_default_archive(db):
+    db.seed_default_committee_db(-100, "Committee", -200, 'zhwiki', [])
+    motion_id = db.create_motion_db("Motion", "", 1, "owner", -999)
+    db.record_vote_db(motion_id, 100, "user100", "support")
+
+    result = db.close_motion_tx(motion_id, functools.partial(bot.archive_messages, None, "期限屆滿"))
+
+    assert result.won
+    queued = {row['dedupe_key']: row['chat_id'] for row in db.get_due_outbox_db(float('inf'), 10)}
+    assert queued == {f"motion:{motion_id}:archive": -200, f"motion:{motion_id}:closed": -999}
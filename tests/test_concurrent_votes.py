@@ -0,0 +1,91 @@
+import asyncio
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from keyed_lock import KeyedLock
+from keyboard_updater import KeyboardUpdater
+
+CHAT_ID = -100
+
+def test_keyed_lock_serialises_one_key_and_not_others():
+    locks = KeyedLock()
+    holders = {'a': 0, 'b': 0}
+    most = {'a': 0, 'b': 0}
+    overlap = []
+
+    async def worker(key):
+        async with locks.hold(key):
+            holders[key] += 1
+            most[key] = max(most[key], holders[key])
+            if holders['a'] and holders['b']:
+                overlap.append(key)
+            await asyncio.sleep(0.001)
+            holders[key] -= 1
+
+    async def main():
+        await asyncio.gather(*(worker(key) for key in 'ab' * 20))
+
+    asyncio.run(main())
+    assert most == {'a': 1, 'b': 1}
+    assert overlap, "different keys should not wait on each other"
+    assert len(locks) == 0
+
+def test_votes_racing_a_close_have_one_winner_and_exact_tallies(db):
+    motion_id = db.create_motion_db("Motion", "", 1, "owner", CHAT_ID)
+    results, accepted = [], []
+    start = threading.Barrier(8)
+
+    def vote(user_id):
+        start.wait()
+        try:
+            for vote_type in random.choices(("support", "oppose", "abstain"), k=20):
+                if db.record_vote_db(motion_id, user_id, f"user{user_id}", vote_type) is not None:
+                    accepted.append(user_id)
+        finally:
+            db.close_db_connection()
+
+    def close():
+        start.wait()
+        try:
+            for _ in range(3):
+                results.append(db.close_motion_tx(motion_id))
+        finally:
+            db.close_db_connection()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(vote, user_id) for user_id in range(100, 105)]
+        futures += [pool.submit(close) for _ in range(3)]
+        for future in futures:
+            future.result()
+
+    winners = [result for result in results if result.won]
+    assert len(winners) == 1
+    counts = {}
+    for row in db.get_motion_votes_db(motion_id):
+        counts[row['vote_type']] = counts.get(row['vote_type'], 0) + 1
+    assert winners[0].tallies == counts
+    assert db.record_vote_db(motion_id, 100, "user100", "support") is None
+    assert db.get_motion_tallies(motion_id) is None
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self.edits.append([button.text for button in reply_markup.inline_keyboard[0]])
+
+def test_older_schedule_landing_last_shows_live_tallies(db):
+    motion_id = db.create_motion_db("Motion", "", 1, "owner", CHAT_ID)
+    older = db.record_vote_db(motion_id, 100, "user100", "support")
+    newer = db.record_vote_db(motion_id, 101, "user101", "oppose")
+    bot = FakeBot()
+    updater = KeyboardUpdater(window=0.01)
+
+    async def main():
+        updater.schedule(bot, CHAT_ID, 1, motion_id, newer)
+        updater.schedule(bot, CHAT_ID, 1, motion_id, older)
+        while updater._tasks:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert bot.edits == [["支持 (1)", "反對 (1)", "棄權 (0)"]]
@@ -0,0 +1,44 @@
+import asyncio
+import metrics
+
+class RecordingServer:
+    """Answers every HTTP request with an empty Bot API result and records its target."""
+
+    def __init__(self):
+        self.targets = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def _handle(self, reader, writer):
+        self.targets.append((await reader.readline()).split()[1].decode())
+        while (await reader.readline()).strip():
+            pass
+        body = b'{"ok": true, "result": true}'
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: '
+                     + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+        await writer.drain()
+        writer.close()
+
+def test_set_proxy_sends_later_requests_through_the_proxy(monkeypatch):
+    monkeypatch.setattr(metrics, 'PROXY_SWAP_GRACE', 0)
+
+    async def main():
+        api, proxy = RecordingServer(), RecordingServer()
+        api_url, proxy_url = await api.start(), await proxy.start()
+        request = metrics.TimedRequest(connection_pool_size=1)
+        await request.initialize()
+        try:
+            await request.post(f"{api_url}/bot123:ABC/getMe")
+            await request.set_proxy(proxy_url)
+            await request.post(f"{api_url}/bot123:ABC/getMe")
+            await asyncio.sleep(0.01)
+            assert not request._retiring
+        finally:
+            await request.shutdown()
+        return api.targets, proxy.targets
+
+    direct, proxied = asyncio.run(main())
+    assert direct == ["/bot123:ABC/getMe"]
+    assert len(proxied) == 1 and proxied[0].endswith("/bot123:ABC/getMe")
@@ -0,0 +1,77 @@
+import asyncio
+from telegram.error import BadRequest, NetworkError
+import database
+import monitor
+
+TITLE = "Wikipedia:仲裁/請求"
+
+class FakeDispatcher:
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, chat_id, text, priority, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        self.sent.append((chat_id, future))
+        return future
+
+def edit_event(revision):
+    return {'type': 'edit', 'wiki': 'zhwiki', 'title': TITLE, 'user': 'Editor',
+            'meta': {'id': f'event-{revision}'}, 'revision': {'old': revision - 1, 'new': revision}}
+
+def follow(db, monkeypatch):
+    db.seed_default_committee_db(-100, "Committee", -200, 'zhwiki', [TITLE])
+    fake = FakeDispatcher()
+    monkeypatch.setattr(monitor, 'dispatcher', fake)
+    monkeypatch.setattr(monitor, 'DIGEST_RETRY_DELAY', 0)
+    return fake
+
+def test_resume_id_waits_for_the_digest_to_be_sent(db, monkeypatch):
+    fake = follow(db, monkeypatch)
+
+    async def main():
+        monitor._replay_from = b'1'
+        assert monitor.process_event(edit_event(11))
+        monitor._replay_from = b'2'
+        assert monitor.process_event(edit_event(12))
+        assert monitor.resume_event_id(b'3') == b'1'
+        monitor.flush_all_digests()
+        assert monitor.resume_event_id(b'3') == b'1'
+        fake.sent[0][1].set_result(None)
+        await asyncio.sleep(0)
+        assert monitor.resume_event_id(b'3') == b'3'
+
+    asyncio.run(main())
+    assert [chat_id for chat_id, _ in fake.sent] == [-100]
+
+def test_failed_digests_are_retried_then_given_up(db, monkeypatch):
+    fake = follow(db, monkeypatch)
+
+    async def main():
+        monitor._replay_from = b'1'
+        monitor.process_event(edit_event(21))
+        monitor.flush_all_digests()
+        fake.sent[0][1].set_exception(NetworkError("timed out"))
+        await asyncio.sleep(0.01)
+        assert len(fake.sent) == 2 and monitor.resume_event_id(b'3') == b'1'
+        fake.sent[1][1].set_exception(BadRequest("Chat not found"))
+        await asyncio.sleep(0.01)
+        assert len(fake.sent) == 2 and monitor.resume_event_id(b'3') == b'3'
+
+    asyncio.run(main())
+
+def test_stop_saves_the_position_after_the_last_digest_is_sent(db, monkeypatch):
+    fake = follow(db, monkeypatch)
+    monkeypatch.setattr(monitor, '_stopped_at', b'9')
+
+    async def main():
+        monitor._replay_from = b'8'
+        monitor.process_event(edit_event(31))
+        stopping = asyncio.ensure_future(monitor.stop_monitor())
+        await asyncio.sleep(0.01)
+        assert not stopping.done()
+        fake.sent[0][1].set_result(None)
+        await stopping
+        await monitor.run_db(database.close_db_connection)
+
+    asyncio.run(main())
+    assert db.get_setting_db(monitor.LAST_EVENT_ID_KEY) == '9'
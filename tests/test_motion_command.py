@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+import bot
+
+CHAT_ID = -100
+motion_command = bot.motion_command.__wrapped__
+
+class FakeMessage:
+    chat_id = CHAT_ID
+    message_id = 1
+
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, data=None, name=None):
+        self.jobs.append((when, data))
+
+def run_motion(*args):
+    message = FakeMessage()
+    update = SimpleNamespace(message=message, effective_chat=SimpleNamespace(id=CHAT_ID),
+                             effective_user=SimpleNamespace(id=1, username="owner", mention_html=lambda: "owner"))
+    context = SimpleNamespace(args=list(args), job_queue=FakeJobQueue())
+
+    async def main():
+        try:
+            await motion_command(update, context)
+        finally:
+            await bot.run_db(bot.close_db_connection)
+
+    asyncio.run(main())
+    return message.replies, context.job_queue.jobs
+
+def test_out_of_range_deadlines_get_the_usage(db):
+    for deadline in ("deadline:0d", "deadline:366d", "deadline:99999999999999999999d"):
+        replies, jobs = run_motion(deadline, "Title")
+        assert replies[0].startswith("用法") and not jobs
+
+def test_only_a_leading_deadline_is_the_option(db):
+    db.seed_default_committee_db(CHAT_ID, "Committee", -200, 'zhwiki', [])
+    replies, jobs = run_motion("Move", "deadline:3d", "to", "Friday")
+    assert "Move deadline:3d to Friday" in replies[0] and not jobs
+
+    replies, jobs = run_motion("deadline:3d", "Title")
+    assert "Title" in replies[0] and len(jobs) == 1
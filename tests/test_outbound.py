@@ -0,0 +1,37 @@
+import asyncio
+from outbound import MessageDispatcher
+
+class SlowBot:
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+        return text
+
+def test_stop_sends_queued_messages_first():
+    bot = SlowBot(0.01)
+
+    async def main():
+        dispatcher = MessageDispatcher()
+        dispatcher.start(bot)
+        for n in range(3):
+            dispatcher.submit(-100, f"message {n}")
+        await dispatcher.stop(timeout=5)
+
+    asyncio.run(main())
+    assert bot.sent == ["message 0", "message 1", "message 2"]
+
+def test_stop_gives_up_after_the_timeout():
+    bot = SlowBot(60)
+
+    async def main():
+        dispatcher = MessageDispatcher()
+        dispatcher.start(bot)
+        dispatcher.submit(-100, "stuck")
+        await asyncio.wait_for(dispatcher.stop(timeout=0.05), 5)
+
+    asyncio.run(main())
+    assert bot.sent == []
@@ -0,0 +1,44 @@
+import asyncio
+from telegram.error import BadRequest, NetworkError
+import outbox
+from database import OutboxMessage, get_db_connection, close_db_connection
+
+class FailingDispatcher:
+    def __init__(self, errors):
+        self.errors = errors
+
+    def submit(self, chat_id, text, priority, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        future.set_exception(self.errors[chat_id])
+        return future
+
+def queue(db, *chat_ids):
+    with get_db_connection() as conn:
+        db._queue_outbox(conn.cursor(), [OutboxMessage(f"test:{chat_id}", chat_id, "text", None, 0)
+                                         for chat_id in chat_ids])
+        conn.commit()
+
+def drain(dispatcher):
+    async def main():
+        try:
+            return await outbox.OutboxDrainer(dispatcher).drain_once()
+        finally:
+            await outbox.run_db(close_db_connection)
+    return asyncio.run(main())
+
+def test_permanent_errors_and_exhausted_retries_are_given_up(db, monkeypatch):
+    monkeypatch.setattr(outbox, 'OUTBOX_MAX_ATTEMPTS', 2)
+    dispatcher = FailingDispatcher({-1: BadRequest("Chat not found"), -2: NetworkError("timed out")})
+    queue(db, -1, -2)
+    dead_before = outbox.outbox_dead.value('BadRequest')
+
+    assert drain(dispatcher) == 2
+    assert db.count_pending_outbox_db() == 1
+    assert outbox.outbox_dead.value('BadRequest') == dead_before + 1
+
+    with get_db_connection() as conn:
+        conn.execute("UPDATE outbox SET next_attempt_at = 0")
+        conn.commit()
+    assert drain(dispatcher) == 1
+    assert db.count_pending_outbox_db() == 0
+    assert db.get_due_outbox_db(float('inf'), 10) == []
@@ -0,0 +1,21 @@
+import asyncio
+import profiling
+
+async def handler(update, context):
+    return "done"
+
+def test_profiling_follows_configure_after_the_handler_is_wrapped(monkeypatch):
+    monkeypatch.setattr(profiling, 'ENABLED', False)
+    monkeypatch.setattr(profiling, '_paths', {})
+    wrapped = profiling.profiled('handler', handler)
+
+    assert asyncio.run(wrapped(None, None)) == "done"
+    assert profiling._paths == {}
+
+    profiling.configure({'enabled': True})
+    assert asyncio.run(wrapped(None, None)) == "done"
+    assert profiling._paths['handler'][0] == 1
+
+    profiling.configure({'enabled': False})
+    asyncio.run(wrapped(None, None))
+    assert profiling._paths['handler'][0] == 1
@@ -0,0 +1,33 @@
+import database
+
+CHAT_ID = -100
+
+def titles(rows):
+    return [row['title'] for row in rows]
+
+def test_short_terms_are_found(db):
+    db.create_motion_db("仲裁動議：封禁用戶甲", "建議封禁一個月。", 1, "owner", CHAT_ID)
+    db.create_motion_db("修訂程序", "關於仲裁程序的修訂。", 1, "owner", CHAT_ID)
+    db.create_motion_db("仲裁另一個委員會", "", 1, "owner", -999)
+
+    rows, has_more = db.search_motions_db(["仲裁"], CHAT_ID)
+    assert titles(rows) == ["修訂程序", "仲裁動議：封禁用戶甲"] and not has_more
+    assert database.SNIPPET_START + "仲裁" + database.SNIPPET_END in rows[0]['snippet']
+
+    rows, _ = db.search_motions_db(["仲裁", "封禁"], CHAT_ID)
+    assert titles(rows) == ["仲裁動議：封禁用戶甲"]
+
+    # A long term goes through the index, the short one filters its hits
+    rows, _ = db.search_motions_db(["封禁用戶", "一個"], CHAT_ID)
+    assert titles(rows) == ["仲裁動議：封禁用戶甲"]
+    rows, _ = db.search_motions_db(["封禁用戶", "程序"], CHAT_ID)
+    assert rows == []
+
+def test_like_wildcards_in_terms_are_literal(db):
+    db.create_motion_db("100% 支持", "", 1, "owner", CHAT_ID)
+    db.create_motion_db("其他", "", 1, "owner", CHAT_ID)
+
+    rows, _ = db.search_motions_db(["%"], CHAT_ID)
+    assert titles(rows) == ["100% 支持"]
+    rows, _ = db.search_motions_db(["_"], CHAT_ID)
+    assert rows == []
@@ -1,29 +1,32 @@
 import functools
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from config import load_config
-from database import get_db_connection
+from database import is_arbitrator_db, get_committee
+from profiling import mark_denied
 
 config = load_config()
-OWNER_ID = config['owner_id']
 
 def is_owner(user_id):
-    return user_id == OWNER_ID
+    # Read on every check so a config reload takes effect immediately
+    return user_id == config['owner_id']
 
-def is_arbitrator(user_id):
+def is_arbitrator(user_id, chat_id=None):
+    """Whether the user may act for the committee of `chat_id` (any committee if None)."""
     if is_owner(user_id):
         return True
         
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM arbitrators WHERE user_id = ?", (user_id,))
-        return cursor.fetchone() is not None
+    return is_arbitrator_db(user_id, chat_id)
 
 def restricted(func):
     @functools.wraps(func)
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user_id = update.effective_user.id
-        if not is_arbitrator(user_id):
+        # In a committee's group only its own arbitrators are let through;
+        # elsewhere (private chats) any arbitrator is
+        chat_id = update.effective_chat.id
+        if not is_arbitrator(user_id, chat_id if get_committee(chat_id) else None):
+            mark_denied()
             await update.message.reply_text("⛔ You are not authorized to use this command.")
             return
         return await func(update, context, *args, **kwargs)
@@ -34,7 +37,28 @@ def owner_only(func):
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user_id = update.effective_user.id
         if not is_owner(user_id):
+            mark_denied()
             await update.message.reply_text("⛔ This command is restricted to the bot owner.")
             return
         return await func(update, context, *args, **kwargs)
     return wrapped
+
+def build_vote_keyboard(motion_id, tallies):
+    support = tallies.get('support', 0)
+    oppose = tallies.get('oppose', 0)
+    abstain = tallies.get('abstain', 0)
+    keyboard = [
+        [
+            InlineKeyboardButton(f"支持 ({support})", callback_data=f"vote:{motion_id}:support"),
+            InlineKeyboardButton(f"反對 ({oppose})", callback_data=f"vote:{motion_id}:oppose"),
+            InlineKeyboardButton(f"棄權 ({abstain})", callback_data=f"vote:{motion_id}:abstain"),
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def retry_after_seconds(error):
+    """Returns the flood-wait delay of a RetryAfter error in seconds."""
+    delay = error.retry_after
+    if hasattr(delay, 'total_seconds'):
+        delay = delay.total_seconds()
+    return float(delay)